@@ -0,0 +1,51 @@
+#
+# Event scoped storage: several agendas hosted side by side, one SQLite database per event.
+#
+# Every event lives in its own <events_dir>/<event>.db file, its snapshot next to it. Importing an
+# event (import_agenda.py --event) therefore only ever locks and rewrites the database of that
+# event, and everything that works per database (the staging swap, the generation counter, the
+# snapshot, the read-only connections) works per event unchanged.
+#
+# Cross-event lookups (lookup_agenda.py --all-events) run the lookup against every event
+# concurrently and merge the results, see async_lookup.MultiEventLookup.
+#
+# This module has no dependencies, so that the importer and the lookups can resolve event
+# databases without loading the asynchronous lookups.
+#
+import os
+import re
+
+# Directory holding the event databases
+DEFAULT_EVENTS_DIR = 'events'
+
+# Event names are used as file names, so they are restricted to a portable subset
+EVENT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+DB_EXTENSION = '.db'
+
+
+#
+# \param event       string  name of the event, e.g. 'isca2018'
+# \param events_dir  string  directory holding the event databases. defaults to DEFAULT_EVENTS_DIR
+#
+# \return path of the database of the event
+#
+# \error ValueError is thrown if the event name is not a valid file name, see EVENT_NAME_PATTERN
+#
+def event_db_path(event, events_dir=None):
+    if not EVENT_NAME_PATTERN.match(event):
+        raise ValueError(f"invalid event name '{event}', only letters, digits, '_', '-' and '.' are allowed")
+    return os.path.join(events_dir or DEFAULT_EVENTS_DIR, event + DB_EXTENSION)
+
+
+#
+# \param events_dir  string  directory holding the event databases. defaults to DEFAULT_EVENTS_DIR
+#
+# \return sorted List of the names of the imported events
+#
+def list_events(events_dir=None):
+    events_dir = events_dir or DEFAULT_EVENTS_DIR
+    if not os.path.isdir(events_dir):
+        return []
+    return sorted(name[:-len(DB_EXTENSION)] for name in os.listdir(events_dir)
+                  if name.endswith(DB_EXTENSION) and EVENT_NAME_PATTERN.match(name[:-len(DB_EXTENSION)]))
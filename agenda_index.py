@@ -0,0 +1,140 @@
+#
+# In-memory agenda index.
+#
+# Loads the 'sessions' and 'speakers' tables once into compact records, along with a hash index
+# per lookup column and the sub-session adjacency, so that lookups become dictionary probes
+# instead of SQL queries. Meant for long running processes (lookup server, batch lookups) where
+# the loading cost is paid once for many lookups.
+#
+# Lookups return exactly the same results, in the same order, as the SQL lookups of LookupAgenda.
+# In particular values are case-folded the way SQLite lower() does it (ASCII letters only) on the
+# stored side, while the looked up value is case-folded by Python, as in the SQL path. Speakers
+# are indexed by their stored case-folded name, which is what the SQL path compares too.
+#
+
+# Translation table of SQLite lower(): only ASCII uppercase letters are folded
+_SQLITE_LOWER = { code: code + 32 for code in range(ord('A'), ord('Z') + 1) }
+
+
+#
+# Compact record of a session.
+#
+class SessionRecord:
+
+    FIELDS = ('id', 'main_session_id', 'date', 'time_start', 'time_end', 'session_title',
+              'location', 'description', 'starts_at', 'ends_at')
+
+    __slots__ = FIELDS
+
+    def __init__(self, values):
+        for field, value in zip(self.FIELDS, values):
+            setattr(self, field, value)
+
+    #
+    # \return { col1: val1, col2: val2, ... }, as returned by the SQL lookups
+    #
+    def as_dict(self):
+        return { field: getattr(self, field) for field in self.FIELDS }
+
+    #
+    # \return (val1, val2, ...), in FIELDS order
+    #
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+
+#
+# Hash indexes and sub-session adjacency over the compact session records.
+#
+class AgendaIndex:
+
+    # Session columns indexed for lookups, 'speaker' being indexed from the speakers table
+    SESSION_COLUMNS = ('date', 'time_start', 'time_end', 'session_title', 'location', 'description')
+
+    #
+    # Loads the tables and builds the indexes.
+    #
+    # \param sessions  db_table  'sessions' table
+    # \param speakers  db_table  'speakers' table, its sessions being read through 'session_speakers'
+    #
+    def __init__(self, sessions, speakers):
+        # id -> SessionRecord
+        self.records = {}
+
+        # main session id -> tuple of its sub-session ids, in id order
+        self.children = {}
+
+        # column -> { case-folded value -> tuple of matching session ids, in id order }
+        self.columns = { column: {} for column in self.SESSION_COLUMNS + ('speaker',) }
+
+        children = {}
+        for row in sessions.iter_select(list(SessionRecord.FIELDS), row_mode='tuple'):
+            record = SessionRecord(row)
+            self.records[record.id] = record
+            children.setdefault(record.main_session_id, []).append(record.id)
+            for column in self.SESSION_COLUMNS:
+                self.add(column, getattr(record, column), record.id)
+
+        query = ("SELECT session_speakers.session_id, speakers.name_key FROM speakers"
+                 " JOIN session_speakers ON session_speakers.speaker_id = speakers.id")
+        for session_id, name_key in speakers.iter_query(query, row_mode='tuple'):
+            # same as the SQL lookup: links to unknown sessions are ignored
+            if session_id in self.records:
+                self.columns['speaker'].setdefault(name_key, []).append(session_id)
+
+        self.children = { main_id: tuple(sorted(ids)) for main_id, ids in children.items() }
+        for index in self.columns.values():
+            for key, ids in index.items():
+                index[key] = tuple(sorted(set(ids)))
+
+    #
+    # Adds a session id to the index of a column
+    #
+    def add(self, column, value, session_id):
+        if value is None:
+            return
+        key = str(value).translate(_SQLITE_LOWER)
+        self.columns[column].setdefault(key, []).append(session_id)
+
+    #
+    # Looks up the sessions whose column matches the value (case-insensitive), along with all
+    # their sub-sessions.
+    #
+    # \param column    string  a LookupAgenda.VALID_COLS entry
+    # \param value     string  the value to search for
+    # \param row_mode  string  "dict" or "tuple" (SessionRecord.FIELDS order)
+    #
+    # \return List of the matching sessions, as LookupAgenda.lookup_column / lookup_speaker
+    #
+    # \error ValueError is thrown if the column is not indexed
+    #
+    def lookup(self, column, value, row_mode = 'dict'):
+        if column not in self.columns:
+            raise ValueError(f'column {column} is not indexed in memory')
+
+        seed_ids = self.columns[column].get(value.lower(), ())
+        records  = self.expand(seed_ids)
+        if row_mode == 'tuple':
+            return [ record.as_tuple() for record in records ]
+        return [ record.as_dict() for record in records ]
+
+    #
+    # Returns the given sessions, each one followed by its sub-sessions (depth first), without
+    # duplicates.
+    #
+    # \param seed_ids  iterable  ids of the matched sessions, in the order they should be returned
+    #
+    # \return List of SessionRecord
+    #
+    def expand(self, seed_ids):
+        out   = []
+        seen  = set()
+        stack = list(reversed(seed_ids))
+        while stack:
+            session_id = stack.pop()
+            if session_id in seen or session_id not in self.records:
+                continue
+            seen.add(session_id)
+            out.append(self.records[session_id])
+            stack.extend(reversed(self.children.get(session_id, ())))
+        return out
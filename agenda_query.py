@@ -0,0 +1,197 @@
+#
+# Compound lookups: a small query language combining several column lookups, e.g.
+#
+#   speaker = 'Anna Marshall' AND location = 'Room 1' AND date = 06/16/2018
+#   location IN ('Room 1', 'Room 2') AND (speaker = "Al Davis" OR speaker = "Diana Tin")
+#
+# A predicate is a column followed by '=' and a value, or by IN and a parenthesized, comma
+# separated list of values. Predicates are combined with AND / OR (AND binding tighter) and
+# parentheses. Columns are the LookupAgenda.VALID_COLS, 'speaker' included, and values are
+# compared case-insensitively, as in the single column lookups. Values can be quoted with ' or "
+# (a doubled quote standing for the quote itself), or left bare: consecutive bare words form a
+# single value, e.g. speaker = Al Davis.
+#
+# A query is compiled into the WHERE clause of a single SELECT over the sessions (see
+# LookupAgenda.compound_query), instead of running every predicate as a lookup of its own and
+# intersecting the results.
+#
+import re
+
+# Keywords of the language, matched case-insensitively
+KEYWORDS = ('AND', 'OR', 'IN')
+
+# Tokens: quoted values, punctuation, and bare words
+TOKEN_PATTERN = re.compile(r"""\s*(?:'((?:[^']|'')*)'|"((?:[^"]|"")*)"|([(),=])|([^\s(),='"]+))""")
+
+
+#
+# Splits a query into tokens
+#
+# \param text  string  the query
+#
+# \return List of (kind, text) tuples, kind being 'value' for a quoted value, 'word' for a bare
+#         word, 'keyword' for AND / OR / IN (uppercased) or the punctuation itself
+#
+# \error ValueError is thrown if a quote is not closed
+#
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            raise ValueError(f'unterminated quote: {text[pos:].strip()}')
+        single, double, punctuation, word = match.groups()
+        if single is not None:
+            tokens.append(('value', single.replace("''", "'")))
+        elif double is not None:
+            tokens.append(('value', double.replace('""', '"')))
+        elif punctuation is not None:
+            tokens.append((punctuation, punctuation))
+        elif word.upper() in KEYWORDS:
+            tokens.append(('keyword', word.upper()))
+        else:
+            tokens.append(('word', word))
+        pos = match.end()
+    return tokens
+
+
+#
+# Parses a query into a tree of nodes:
+#   ('or', [node, ...]) and ('and', [node, ...]), of at least two nodes
+#   ('in', column, [value, ...]), for both '=' and IN predicates, values being case-folded
+#
+# \param text     string  the query
+# \param columns  set     columns allowed in the predicates
+#
+# \return the root node
+#
+# \error ValueError is thrown if the query is malformed or uses an unknown column
+#
+def parse_query(text, columns):
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError('empty query')
+
+    node, pos = parse_or(tokens, 0, columns)
+    if pos < len(tokens):
+        raise ValueError(f"unexpected '{tokens[pos][1]}'")
+    return node
+
+
+#
+# Recursive descent parsers of parse_query. Each one parses the construct starting at tokens[pos]
+# and returns the parsed node along with the position of the next token.
+#
+def parse_or(tokens, pos, columns):
+    nodes = []
+    while True:
+        node, pos = parse_and(tokens, pos, columns)
+        nodes.append(node)
+        if not is_keyword(tokens, pos, 'OR'):
+            break
+        pos += 1
+    return (nodes[0] if len(nodes) == 1 else ('or', nodes)), pos
+
+def parse_and(tokens, pos, columns):
+    nodes = []
+    while True:
+        node, pos = parse_term(tokens, pos, columns)
+        nodes.append(node)
+        if not is_keyword(tokens, pos, 'AND'):
+            break
+        pos += 1
+    return (nodes[0] if len(nodes) == 1 else ('and', nodes)), pos
+
+def parse_term(tokens, pos, columns):
+    kind, text = token_at(tokens, pos, 'a column or (')
+    if kind == '(':
+        node, pos = parse_or(tokens, pos + 1, columns)
+        expect(tokens, pos, ')')
+        return node, pos + 1
+
+    column = text.lower()
+    if kind != 'word' or column not in columns:
+        raise ValueError(f"unknown column '{text}', columns must be one of the following: {columns}")
+
+    kind, text = token_at(tokens, pos + 1, "'=' or IN")
+    if kind == '=':
+        value, pos = parse_value(tokens, pos + 2)
+        return ('in', column, [value.lower()]), pos
+    if kind != 'keyword' or text != 'IN':
+        raise ValueError(f"expected '=' or IN after {column}, found '{text}'")
+
+    expect(tokens, pos + 2, '(')
+    values = []
+    pos += 3
+    while True:
+        value, pos = parse_value(tokens, pos)
+        values.append(value.lower())
+        kind, text = token_at(tokens, pos, "',' or )")
+        if kind == ')':
+            return ('in', column, values), pos + 1
+        if kind != ',':
+            raise ValueError(f"expected ',' or ')' in the IN list, found '{text}'")
+        pos += 1
+
+def parse_value(tokens, pos):
+    kind, text = token_at(tokens, pos, 'a value')
+    if kind == 'value':
+        return text, pos + 1
+    if kind != 'word':
+        raise ValueError(f"expected a value, found '{text}'")
+
+    words = []
+    while pos < len(tokens) and tokens[pos][0] == 'word':
+        words.append(tokens[pos][1])
+        pos += 1
+    return ' '.join(words), pos
+
+
+#
+# \return the token at pos
+#
+# \error ValueError is thrown if the query ends before pos, mentioning what was expected
+#
+def token_at(tokens, pos, expected):
+    if pos >= len(tokens):
+        raise ValueError(f'unexpected end of query, expected {expected}')
+    return tokens[pos]
+
+def expect(tokens, pos, kind):
+    found_kind, text = token_at(tokens, pos, f"'{kind}'")
+    if found_kind != kind:
+        raise ValueError(f"expected '{kind}', found '{text}'")
+
+def is_keyword(tokens, pos, keyword):
+    return pos < len(tokens) and tokens[pos] == ('keyword', keyword)
+
+
+#
+# Compiles a parsed query into a condition on the sessions table.
+# Session columns are compared through lower(column), matching the expression indexes declared
+# in agenda_schema. A speaker predicate becomes a sessions.id IN (...) subquery probing the
+# unique speakers.name_key, then the session_speakers speaker_id index.
+#
+# \param node  tuple  node returned by parse_query
+#
+# \return (SQL condition string, params)
+#
+def compile_query(node):
+    kind = node[0]
+    if kind in ('and', 'or'):
+        conditions, params = [], []
+        for child in node[1]:
+            condition, child_params = compile_query(child)
+            conditions.append(f'({condition})')
+            params.extend(child_params)
+        return f' {kind.upper()} '.join(conditions), params
+
+    _, column, values = node
+    placeholders = ', '.join('?' * len(values))
+    if column == 'speaker':
+        return ("sessions.id IN (SELECT session_speakers.session_id FROM speakers"
+                " JOIN session_speakers ON session_speakers.speaker_id = speakers.id"
+                f" WHERE speakers.name_key IN ({placeholders}))"), list(values)
+    return f"lower(sessions.{column}) IN ({placeholders})", list(values)
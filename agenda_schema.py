@@ -0,0 +1,91 @@
+#
+# Schemas and indexes of the agenda tables, shared by the import and lookup programs.
+#
+# Indexes map an index suffix to the indexed column(s) or expression(s), see db_table.
+# Lookups compare lower(column) to the case-folded value, so the lookup columns are indexed
+# on the lower() expression rather than on the raw column.
+#
+
+# Table for sessions:
+# Table will include information such as the PRIMARY KEY session id, another session id
+# (if it is a sub-session), date of the session, starting and ending time of the session,
+# name of the session, session location, and the description for the session.
+# starts_at and ends_at are the sortable timestamps of the session, see agenda_time.
+SESSIONS_SCHEMA = {
+    'id': 'integer PRIMARY KEY',
+    'main_session_id': 'integer',
+    'date': 'text',
+    'time_start': 'text',
+    'time_end': 'text',
+    'session_title': 'text',
+    'location': 'text',
+    'description': 'text',
+    'starts_at': 'text',
+    'ends_at': 'text'
+}
+
+# main_session_id is used to find the sub-sessions of a session, the lower_* ones back the
+# case-insensitive column lookups, and the remaining ones the time range lookups.
+SESSIONS_INDEXES = {
+    'main_session_id': 'main_session_id',
+    'lower_date': 'lower(date)',
+    'lower_time_start': 'lower(time_start)',
+    'lower_time_end': 'lower(time_end)',
+    'lower_session_title': 'lower(session_title)',
+    'lower_location': 'lower(location)',
+    'lower_description': 'lower(description)',
+    'starts_at': 'starts_at, ends_at',
+    'room_starts_at': 'lower(location), starts_at, ends_at'
+}
+
+# Full-text index of the sessions, an FTS5 virtual table whose rowid is the session id.
+# It stores its own copy of the indexed text so that it can be kept in sync row by row by
+# incremental imports.
+SESSIONS_FTS_SCHEMA = {
+    'session_title': '',
+    'description': ''
+}
+
+# Table for the speakers:
+# Table will include information on the PRIMARY KEY speaker id, the name of the speaker (as first
+# seen in the agenda) and its case-folded name, which identifies the speaker. Each speaker is only
+# stored once, however many sessions they speak at. The UNIQUE constraint indexes name_key.
+SPEAKERS_SCHEMA = {
+    'id': 'integer PRIMARY KEY',
+    'speaker_name': 'text',
+    'name_key': 'text UNIQUE'
+}
+
+SPEAKERS_INDEXES = {}
+
+# Table linking the sessions to their speakers:
+# Table will include a row per (session id, speaker id) pair, in the order the speakers are
+# listed for the session.
+SESSION_SPEAKERS_SCHEMA = {
+    'session_id': 'integer',
+    'speaker_id': 'integer'
+}
+
+# speaker_id finds the sessions of a speaker (and counts them) without reading the table,
+# session_id finds the speakers of a session.
+SESSION_SPEAKERS_INDEXES = {
+    'speaker_id': 'speaker_id, session_id',
+    'session_id': 'session_id'
+}
+
+# Table of the speaker name trigrams:
+# Table will include a row per (trigram, speaker id) pair, see agenda_trigrams, along with the
+# number of trigrams of the speaker name. It is derived from the speakers table by the importer,
+# and backs the fuzzy and prefix speaker lookups.
+SPEAKER_TRIGRAMS_SCHEMA = {
+    'trigram': 'text',
+    'speaker_id': 'integer',
+    'trigram_count': 'integer'
+}
+
+# trigram finds the speakers sharing trigrams with a searched name, and ranks them by similarity,
+# without reading the table. speaker_id finds the trigrams of a deleted speaker.
+SPEAKER_TRIGRAMS_INDEXES = {
+    'trigram': 'trigram, speaker_id, trigram_count',
+    'speaker_id': 'speaker_id'
+}
@@ -0,0 +1,340 @@
+#
+# Compiled agenda snapshot.
+#
+# A compact, versioned binary file holding the sessions, the sub-session adjacency and the
+# lookup index of every LookupAgenda.VALID_COLS column, written by the importer next to the
+# database. Lookups memory-map it and read the records straight from the mapping: opening it
+# costs a file open and a header read, whatever the size of the agenda, and nothing is loaded
+# besides the records that are returned.
+#
+# The snapshot records the database generation (see db_table.generation) it was compiled from,
+# and is rebuilt by open_current when the database changed since. Generations restart along with
+# the database, so the importer removes the previous snapshots on every import, see
+# ImportAgenda.remove_snapshots.
+#
+# Results are the same, in the same order, as the ones of AgendaIndex, from which it is compiled.
+#
+# Layout, all integers little-endian:
+#   header           HEADER: magic, version, generation, number of sessions, number of strings
+#   sections         SECTIONS entries of SECTION: (offset, length) of each section below
+#   string_offsets   u32 * (strings + 1), offsets of the strings in string_data
+#   string_data      UTF-8 strings, deduplicated
+#   sessions         SESSION * sessions, sorted by id: id, main session id (-1 if none) and the
+#                    string number of the other SessionRecord.FIELDS (NULL_STRING if NULL)
+#   child_offsets    u32 * (sessions + 1), range of each session sub-sessions in children
+#   children         u32 session numbers, sorted by id
+#   columns          COLUMN * len(COLUMNS): number of keys, then the offsets of its keys (u32
+#                    string numbers of the case-folded values, sorted by UTF-8 bytes), of its
+#                    postings offsets (u32 * (keys + 1)) and of its postings (u32 session numbers,
+#                    sorted by id)
+#
+import os
+import mmap
+import struct
+import sqlite3
+import pathlib
+from db_table import db_table
+from agenda_index import AgendaIndex, SessionRecord
+from agenda_schema import SESSIONS_SCHEMA, SPEAKERS_SCHEMA
+
+
+class AgendaSnapshot:
+
+    MAGIC   = b'AGENDASN'
+    VERSION = 1
+
+    HEADER  = struct.Struct('<8sIQII')
+    SECTION = struct.Struct('<QQ')
+    SESSION = struct.Struct('<qq%dI' % (len(SessionRecord.FIELDS) - 2))
+    COLUMN  = struct.Struct('<IQQQ')
+    U32     = struct.Struct('<I')
+    U32_2   = struct.Struct('<II')
+
+    SECTIONS = ('string_offsets', 'string_data', 'sessions', 'child_offsets', 'children', 'columns')
+
+    # Indexed columns, in file order
+    COLUMNS = AgendaIndex.SESSION_COLUMNS + ('speaker',)
+
+    # String number of NULL values
+    NULL_STRING = 0xFFFFFFFF
+
+    #
+    # Memory-maps a snapshot file.
+    #
+    # \param path  string  path to the snapshot file
+    #
+    # \error RuntimeError is thrown if the file is not a snapshot of the current VERSION
+    #
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        try:
+            magic, version, self.generation, self.session_count, self.string_count = \
+                self.HEADER.unpack_from(self.mmap, 0)
+        except struct.error:
+            magic, version = None, None
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise RuntimeError(f'{path} is not a version {self.VERSION} agenda snapshot')
+
+        self.sections = {}
+        for num, name in enumerate(self.SECTIONS):
+            self.sections[name] = self.SECTION.unpack_from(self.mmap, self.HEADER.size + num * self.SECTION.size)[0]
+
+        self.columns = {}
+        for num, column in enumerate(self.COLUMNS):
+            self.columns[column] = self.COLUMN.unpack_from(self.mmap, self.sections['columns'] + num * self.COLUMN.size)
+
+    #
+    # Looks up the sessions whose column matches the value (case-insensitive), along with all
+    # their sub-sessions, see AgendaIndex.lookup.
+    #
+    # \param column    string  a LookupAgenda.VALID_COLS entry
+    # \param value     string  the value to search for
+    # \param row_mode  string  "dict" or "tuple" (SessionRecord.FIELDS order)
+    #
+    # \return List of the matching sessions
+    #
+    # \error ValueError is thrown if the column is not indexed
+    #
+    def lookup(self, column, value, row_mode = 'dict'):
+        if column not in self.columns:
+            raise ValueError(f'column {column} is not indexed in the snapshot')
+
+        records = [ self.session(num) for num in self.expand(self.seeds(column, value.lower())) ]
+        if row_mode == 'tuple':
+            return records
+        return [ dict(zip(SessionRecord.FIELDS, record)) for record in records ]
+
+    #
+    # Binary search of a case-folded value in the keys of a column
+    #
+    # \return tuple of the numbers of the sessions matching the value, in id order
+    #
+    def seeds(self, column, key):
+        key_count, keys_offset, postings_offsets, postings = self.columns[column]
+        key = key.encode('utf-8')
+
+        low, high = 0, key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string_bytes(self.U32.unpack_from(self.mmap, keys_offset + 4 * middle)[0]) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == key_count or self.string_bytes(self.U32.unpack_from(self.mmap, keys_offset + 4 * low)[0]) != key:
+            return ()
+        start, end = self.U32_2.unpack_from(self.mmap, postings_offsets + 4 * low)
+        return struct.unpack_from('<%dI' % (end - start), self.mmap, postings + 4 * start)
+
+    #
+    # Returns the given sessions, each one followed by its sub-sessions (depth first), without
+    # duplicates, see AgendaIndex.expand
+    #
+    # \param seeds  iterable  numbers of the matched sessions, in the order they should be returned
+    #
+    # \return List of session numbers
+    #
+    def expand(self, seeds):
+        out   = []
+        seen  = set()
+        stack = list(reversed(seeds))
+        while stack:
+            num = stack.pop()
+            if num in seen:
+                continue
+            seen.add(num)
+            out.append(num)
+
+            start, end = self.U32_2.unpack_from(self.mmap, self.sections['child_offsets'] + 4 * num)
+            if end > start:
+                children = struct.unpack_from('<%dI' % (end - start), self.mmap, self.sections['children'] + 4 * start)
+                stack.extend(reversed(children))
+        return out
+
+    #
+    # \return the values of a session, in SessionRecord.FIELDS order
+    #
+    def session(self, num):
+        session_id, main_session_id, *strings = self.SESSION.unpack_from(
+            self.mmap, self.sections['sessions'] + num * self.SESSION.size)
+        return (session_id, None if main_session_id < 0 else main_session_id) + \
+               tuple(None if string == self.NULL_STRING else self.string(string) for string in strings)
+
+    #
+    # \return string number num, decoded straight from the mapping
+    #
+    def string(self, num):
+        start, end = self.U32_2.unpack_from(self.mmap, self.sections['string_offsets'] + 4 * num)
+        data = self.sections['string_data']
+        return str(self.view[data + start:data + end], 'utf-8')
+
+    #
+    # \return the UTF-8 bytes of string number num
+    #
+    def string_bytes(self, num):
+        start, end = self.U32_2.unpack_from(self.mmap, self.sections['string_offsets'] + 4 * num)
+        data = self.sections['string_data']
+        return self.mmap[data + start:data + end]
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+
+    #
+    # \return the default path of the snapshot of a database: <database path>.snapshot
+    #
+    @staticmethod
+    def default_path(db_path = None):
+        return (db_path or db_table.DB_NAME) + '.snapshot'
+
+    #
+    # Opens the snapshot of a database, compiling it first if it is missing, of another VERSION
+    # or older than the database generation.
+    #
+    # \param db_path  string  path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param path     string  path to the snapshot file. defaults to default_path(db_path)
+    #
+    # \return AgendaSnapshot
+    #
+    # \error sqlite3.Error is thrown if the database cannot be read
+    #
+    @classmethod
+    def open_current(cls, db_path = None, path = None):
+        db_path = db_path or db_table.DB_NAME
+        path = path or cls.default_path(db_path)
+
+        # a bare connection: reading the generation needs neither the tables nor their setup
+        conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            generation = conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+
+        try:
+            snapshot = cls(path)
+            if snapshot.generation == generation:
+                return snapshot
+            snapshot.close()
+        except (OSError, ValueError, RuntimeError):
+            # missing, empty or of another version
+            pass
+
+        cls.build(db_path, path)
+        return cls(path)
+
+    #
+    # Compiles the snapshot of a database.
+    # The database is read in a single read transaction, so that the snapshot and its generation
+    # match even if an import commits meanwhile.
+    #
+    # \param db_path  string  path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param path     string  path to the snapshot file. defaults to default_path(db_path)
+    #
+    @classmethod
+    def build(cls, db_path = None, path = None):
+        sessions = db_table('sessions', SESSIONS_SCHEMA, db_path=db_path, read_only=True)
+        speakers = db_table('speakers', SPEAKERS_SCHEMA, db_path=db_path, read_only=True)
+        try:
+            sessions.db_conn.execute('BEGIN')
+            generation = sessions.generation()
+            index = AgendaIndex(sessions, speakers)
+            sessions.db_conn.rollback()
+        finally:
+            sessions.close()
+            speakers.close()
+
+        cls.write(path or cls.default_path(db_path), index, generation)
+
+    #
+    # Writes the snapshot of an AgendaIndex.
+    # The file is written aside and renamed over the previous one, so that readers never see a
+    # partially written snapshot.
+    #
+    # \param path        string      path to the snapshot file
+    # \param index       AgendaIndex  index to compile
+    # \param generation  integer     database generation the index was loaded from
+    #
+    @classmethod
+    def write(cls, path, index, generation):
+        strings = {}
+        def string_num(value):
+            if value is None:
+                return cls.NULL_STRING
+            return strings.setdefault(str(value), len(strings))
+
+        ids = sorted(index.records)
+        nums = { session_id: num for num, session_id in enumerate(ids) }
+
+        sessions = bytearray()
+        child_offsets, children = [ 0 ], []
+        for session_id in ids:
+            record = index.records[session_id].as_tuple()
+            main_session_id = -1 if record[1] is None else record[1]
+            sessions += cls.SESSION.pack(record[0], main_session_id, *[ string_num(value) for value in record[2:] ])
+
+            children.extend(nums[child] for child in index.children.get(session_id, ()) if child in nums)
+            child_offsets.append(len(children))
+
+        column_arrays = []
+        for column in cls.COLUMNS:
+            keys = sorted(index.columns[column], key=lambda key: key.encode('utf-8'))
+            postings_offsets, postings = [ 0 ], []
+            for key in keys:
+                postings.extend(nums[session_id] for session_id in index.columns[column][key])
+                postings_offsets.append(len(postings))
+            column_arrays.append((len(keys), [ string_num(key) for key in keys ], postings_offsets, postings))
+
+        encoded = [ value.encode('utf-8') for value in strings ]
+        string_offsets = [ 0 ]
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        # sections, then the arrays of each column referenced from the columns section
+        data = {
+            'string_offsets': pack_u32(string_offsets),
+            'string_data': b''.join(encoded),
+            'sessions': bytes(sessions),
+            'child_offsets': pack_u32(child_offsets),
+            'children': pack_u32(children)
+        }
+        offset = cls.HEADER.size + len(cls.SECTIONS) * cls.SECTION.size
+        layout, body = {}, []
+        for name in cls.SECTIONS[:-1]:
+            layout[name] = (offset, len(data[name]))
+            body.append(data[name])
+            offset += len(data[name])
+
+        columns_offset = offset
+        offset += len(cls.COLUMNS) * cls.COLUMN.size
+        column_entries, column_body = [], []
+        for key_count, keys, postings_offsets, postings in column_arrays:
+            arrays = [ pack_u32(keys), pack_u32(postings_offsets), pack_u32(postings) ]
+            offsets = []
+            for array in arrays:
+                offsets.append(offset)
+                column_body.append(array)
+                offset += len(array)
+            column_entries.append(cls.COLUMN.pack(key_count, *offsets))
+        layout['columns'] = (columns_offset, len(cls.COLUMNS) * cls.COLUMN.size)
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, generation, len(ids), len(strings))
+        sections = b''.join(cls.SECTION.pack(*layout[name]) for name in cls.SECTIONS)
+
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as snapshot_file:
+            snapshot_file.write(header + sections)
+            for chunk in body + column_entries + column_body:
+                snapshot_file.write(chunk)
+        os.replace(temp_path, path)
+
+
+#
+# \return the given integers packed as little-endian u32
+#
+def pack_u32(values):
+    return struct.pack('<%dI' % len(values), *values)
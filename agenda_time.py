@@ -0,0 +1,88 @@
+#
+# Normalization of the agenda dates and times.
+#
+# The agenda stores dates and times as free text ('06/16/2018', '08:30 AM'). Alongside them, the
+# sessions get sortable 'starts_at' / 'ends_at' timestamps ('2018-06-16 08:30:00', the format of
+# SQLite datetime()) so that time ranges can be answered through index range scans.
+#
+# A session ending before it starts is taken to end on the next day, so a session never lasts
+# more than a day. Range lookups rely on this to bound their index scans, see
+# LookupAgenda.overlapping_query.
+#
+from datetime import datetime, timedelta
+
+# Sortable format of the normalized timestamps
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Formats of the dates and times found in the agenda
+DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d')
+TIME_FORMATS = ('%I:%M %p', '%I:%M%p', '%H:%M', '%H:%M:%S')
+
+# Longest a session can last, see above
+MAX_DURATION = timedelta(days=1)
+
+
+#
+# Parses text according to the first matching format
+#
+# \return datetime, or None if no format matches
+#
+def parse_any(text, formats):
+    text = text.strip().upper()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+#
+# Normalizes the date and times of a session.
+#
+# \param date        string  date of the session, e.g. '06/16/2018'
+# \param time_start  string  starting time of the session, e.g. '08:30 AM'
+# \param time_end    string  ending time of the session, e.g. '09:45 AM'
+#
+# \return (starts_at, ends_at) timestamps in TIMESTAMP_FORMAT, or (None, None) if the date or
+#         times cannot be parsed
+#
+def session_interval(date, time_start, time_end):
+    day   = parse_any(date, DATE_FORMATS)
+    start = parse_any(time_start, TIME_FORMATS)
+    end   = parse_any(time_end, TIME_FORMATS)
+    if day is None or start is None or end is None:
+        return None, None
+
+    starts_at = datetime.combine(day.date(), start.time())
+    ends_at   = datetime.combine(day.date(), end.time())
+    if ends_at < starts_at:
+        ends_at += timedelta(days=1)
+    return starts_at.strftime(TIMESTAMP_FORMAT), ends_at.strftime(TIMESTAMP_FORMAT)
+
+
+#
+# Parses a point in time given by the user, either as a timestamp ('2018-06-16 08:30') or in the
+# agenda format ('06/16/2018 08:30 AM').
+#
+# \param text  string  the date and time
+#
+# \return datetime
+#
+# \error ValueError is thrown if the text is not a date followed by a time
+#
+def parse_timestamp(text):
+    parts = text.split(None, 1)
+    if len(parts) == 2:
+        day  = parse_any(parts[0], DATE_FORMATS)
+        time = parse_any(parts[1], TIME_FORMATS)
+        if day is not None and time is not None:
+            return datetime.combine(day.date(), time.time())
+    raise ValueError(f"'{text}' is not a date and time, e.g. '2018-06-16 08:30' or '06/16/2018 08:30 AM'")
+
+
+#
+# \return the given datetime in TIMESTAMP_FORMAT
+#
+def format_timestamp(moment):
+    return moment.strftime(TIMESTAMP_FORMAT)
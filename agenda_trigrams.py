@@ -0,0 +1,80 @@
+#
+# Trigrams of the speaker names, backing the fuzzy and prefix speaker lookups.
+#
+# As in PostgreSQL's pg_trgm, a name is case-folded and split into words, and every word is
+# padded with two spaces in front and one behind before being cut into trigrams, so that
+# 'Al Davis' gives '  a', ' al', 'al ', '  d', ' da', 'dav', 'avi', 'vis', 'is '. Two names are
+# as similar as the share of trigrams they have in common (Jaccard index of their trigram sets),
+# which tolerates misspellings and missing or extra words such as middle initials.
+#
+# The importer stores the trigrams of every speaker in the 'speaker_trigrams' table (see
+# agenda_schema), so that the speakers sharing trigrams with a searched name are found through
+# index lookups, see LookupAgenda.match_speakers.
+#
+import re
+
+# Words of a name: runs of letters and digits
+WORD_PATTERN = re.compile(r'\w+')
+
+# Default minimum similarity of the fuzzy matches, the pg_trgm default
+SIMILARITY_THRESHOLD = 0.3
+
+
+#
+# \return List of the case-folded words of a name
+#
+def name_words(name):
+    return WORD_PATTERN.findall(name.lower())
+
+
+#
+# \param name  string  speaker name
+#
+# \return set of the trigrams of the name
+#
+def trigrams(name):
+    grams = set()
+    for word in name_words(name):
+        word = '  ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+#
+# Trigrams that every name starting with the given words contains: the words are only padded in
+# front, since they may continue in the matched name.
+#
+# \param text  string  beginning of the words of a name, e.g. 'ann mar' for 'Anna Marshall'
+#
+# \return set of the trigrams
+#
+def prefix_trigrams(text):
+    grams = set()
+    for word in name_words(text):
+        word = '  ' + word
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+#
+# \param grams        set  trigrams of the searched name
+# \param other_grams  set  trigrams of a candidate name
+#
+# \return similarity of the two names, from 0 (no trigram in common) to 1 (same trigrams)
+#
+def similarity(grams, other_grams):
+    if not grams or not other_grams:
+        return 0.0
+    shared = len(grams & other_grams)
+    return shared / (len(grams) + len(other_grams) - shared)
+
+
+#
+# \param text  string  beginning of the words of a name, e.g. 'ann mar'
+# \param name  string  candidate name, e.g. 'Anna Marshall'
+#
+# \return whether every word of text starts a distinct word of name, in the same order
+#
+def is_word_prefix(text, name):
+    words = iter(name_words(name))
+    return all(any(word.startswith(prefix) for word in words) for prefix in name_words(text))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import os
+import sys
+import asyncio
+import sqlite3
+import argparse
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from db_table import db_table
+from lookup_agenda import LookupAgenda, print_sessions
+from agenda_events import DEFAULT_EVENTS_DIR, event_db_path, list_events
+
+#
+# asyncio facade over LookupAgenda, for async frontends serving many lookups at once.
+#
+# Lookups run on a bounded pool of worker threads, each one owning its own LookupAgenda and so
+# its own read-only connection to the database (sqlite connections are bound to the thread that
+# opened them, see db_table.connect). sqlite releases the GIL while running a statement, so
+# concurrent lookups overlap instead of queueing behind a single connection.
+#
+# Connections are opened lazily, by the first lookup run on each worker thread. A lookup can target
+# another database than the default one (e.g. another event, see agenda_events), the workers then
+# keeping a connection to each database they looked into.
+#
+# Example async with AsyncLookupAgenda("event.db") as agenda:
+#             sessions = await agenda.lookup("speaker", "Al Davis")
+#
+class AsyncLookupAgenda:
+
+    # Number of worker threads, and so of database connections
+    DEFAULT_POOL_SIZE = 4
+
+    #
+    # \param db_path    string   path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param pool_size  integer  number of worker threads and database connections
+    #
+    def __init__(self, db_path=None, pool_size=DEFAULT_POOL_SIZE):
+        self.db_path   = db_path
+        self.pool_size = pool_size
+        self.executor  = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='lookup')
+
+        # { db_path: LookupAgenda } of each worker thread
+        self.local = threading.local()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    #
+    # Runs a lookup, see LookupAgenda.iter_lookup
+    #
+    # \param column   string  the column to search by, 'speaker', LookupAgenda.TEXT_SEARCH or
+    #                         LookupAgenda.QUERY
+    # \param value    string  the value to search for
+    # \param db_path  string  database to look into. defaults to the db_path of this instance
+    #
+    # \return List of the matching sessions
+    #
+    # \error ValueError is thrown if the column is not a VALID_COLS entry, TEXT_SEARCH nor QUERY, or if
+    #                    a compound query is malformed
+    # \error sqlite3.OperationalError is thrown if a full-text query is malformed
+    #
+    async def lookup(self, column, value, db_path=None):
+        column = column.lower()
+        if column not in LookupAgenda.VALID_COLS and column not in (LookupAgenda.TEXT_SEARCH, LookupAgenda.QUERY):
+            raise ValueError(f'Column must be one of the following: {LookupAgenda.VALID_COLS}')
+        return await self.run(lambda agenda: list(agenda.iter_lookup(column, value)), db_path)
+
+    #
+    # Runs a read query on one of the pooled connections, see db_table.query
+    #
+    # \param query   string         SQL query to run
+    # \param params  array<string>  values bound to the '?' placeholders of the query
+    #
+    # \return List of { col1: val1, col2: val2, ... }
+    #
+    async def query(self, query, params=()):
+        return await self.run(lambda agenda: agenda.sessions.query(query, params))
+
+    #
+    # Runs a function on a worker thread, with the LookupAgenda of that thread
+    #
+    # \param func     callable  called with the LookupAgenda
+    # \param db_path  string    database to look into. defaults to the db_path of this instance
+    #
+    # \return result of func
+    #
+    async def run(self, func, db_path=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(self.run_on_worker, func, db_path or self.db_path))
+
+    def run_on_worker(self, func, db_path):
+        agendas = getattr(self.local, 'agendas', None)
+        if agendas is None:
+            agendas = self.local.agendas = {}
+        if db_path not in agendas:
+            agendas[db_path] = LookupAgenda(db_path, read_only=True)
+        return func(agendas[db_path])
+
+    #
+    # Closes the connections and stops the worker threads.
+    # A connection can only be closed by its own thread, so a closing task is run on every worker,
+    # the barrier ensuring that no worker runs two of them.
+    #
+    async def close(self):
+        barrier = threading.Barrier(self.pool_size)
+        loop = asyncio.get_running_loop()
+        closing = [ loop.run_in_executor(self.executor, self.close_worker, barrier)
+                    for _ in range(self.pool_size) ]
+        await asyncio.gather(*closing)
+        self.executor.shutdown()
+
+    def close_worker(self, barrier):
+        barrier.wait()
+        for agenda in getattr(self.local, 'agendas', {}).values():
+            agenda.close_conn()
+        self.local.agendas = {}
+
+
+#
+# Lookups across several events.
+# Each lookup is run against every event at once, on the worker threads of a single
+# AsyncLookupAgenda, and the results are merged in event name order, the sessions of each event
+# keeping their own order. Every returned session gets an 'event' key naming its event.
+#
+# Example async with MultiEventLookup() as events:
+#             sessions = await events.lookup("speaker", "Al Davis")
+#
+class MultiEventLookup:
+
+    #
+    # \param events      list     names of the events to look into. defaults to every imported event
+    # \param events_dir  string   directory holding the event databases. defaults to DEFAULT_EVENTS_DIR
+    # \param pool_size   integer  number of worker threads, shared by all the events
+    #
+    # \error ValueError is thrown if an event name is invalid
+    # \error RuntimeError is thrown if an event is not imported, or if there is no event at all
+    #
+    def __init__(self, events=None, events_dir=None, pool_size=AsyncLookupAgenda.DEFAULT_POOL_SIZE):
+        self.events = sorted(set(events)) if events else list_events(events_dir)
+        if not self.events:
+            raise RuntimeError(f"no event imported in {events_dir or DEFAULT_EVENTS_DIR}")
+
+        self.db_paths = {}
+        for event in self.events:
+            self.db_paths[event] = event_db_path(event, events_dir)
+            if not os.path.exists(self.db_paths[event]):
+                raise RuntimeError(f"unknown event '{event}', import it first with import_agenda.py --event {event}")
+
+        self.agenda = AsyncLookupAgenda(pool_size=pool_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    #
+    # Runs a lookup against every event, see AsyncLookupAgenda.lookup
+    #
+    # \return List of the matching sessions of all the events, each with an 'event' key
+    #
+    # \error ValueError is thrown if the column is invalid or the compound query is malformed
+    # \error sqlite3.OperationalError is thrown if a full-text query is malformed
+    #
+    async def lookup(self, column, value):
+        results = await asyncio.gather(*[ self.agenda.lookup(column, value, self.db_paths[event])
+                                          for event in self.events ])
+        return [ dict(session, event=event) for event, sessions in zip(self.events, results)
+                 for session in sessions ]
+
+    async def close(self):
+        await self.agenda.close()
+
+
+#
+# Runs a lookup against several events concurrently, see MultiEventLookup.
+#
+# \param events      list    names of the events, None for every imported event
+# \param events_dir  string  directory holding the event databases
+#
+# \return List of the matching sessions of all the events
+#
+async def lookup_events(events, events_dir, column, value):
+    async with MultiEventLookup(events, events_dir) as multi_event_lookup:
+        return await multi_event_lookup.lookup(column, value)
+
+
+#
+# Runs the given lookups concurrently and prints their results in order.
+#
+# \param lookups  list  (column, value) pairs
+#
+# \return number of failed lookups
+#
+async def run_lookups(db_path, pool_size, lookups):
+    async with AsyncLookupAgenda(db_path, pool_size) as agenda:
+        results = await asyncio.gather(*[ agenda.lookup(column, value) for column, value in lookups ],
+                                       return_exceptions=True)
+
+    failures = 0
+    for (column, value), result in zip(lookups, results):
+        print(f'### {column} = {value}')
+        if isinstance(result, (ValueError, RuntimeError, sqlite3.Error)):
+            print(f'Error: {result}\n')
+            failures += 1
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            print_sessions(result)
+            print()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(usage='./async_lookup.py [--db <database path>] [--pool-size <count>] '
+                                           '<column> <value> [<column> <value>...]')
+    parser.add_argument('lookups', nargs='+', metavar='column value')
+    parser.add_argument('--db', dest='db_path', default=None,
+                        help=f'SQLite database to look into (default: {db_table.DB_NAME})')
+    parser.add_argument('--pool-size', type=int, default=AsyncLookupAgenda.DEFAULT_POOL_SIZE,
+                        help=f'number of concurrent connections (default: {AsyncLookupAgenda.DEFAULT_POOL_SIZE})')
+    args = parser.parse_args()
+
+    if len(args.lookups) % 2:
+        parser.print_usage()
+        print('Error: every column must be followed by a value')
+        sys.exit(1)
+
+    lookups = list(zip(args.lookups[::2], args.lookups[1::2]))
+    failures = asyncio.run(run_lookups(args.db_path, args.pool_size, lookups))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import platform
+import argparse
+import itertools
+import tempfile
+from datetime import datetime
+from import_agenda import ImportAgenda
+from lookup_agenda import LookupAgenda
+from generate_agenda import GenerateAgenda
+
+#
+# Benchmark of the import and lookups on generated agendas (see generate_agenda.py).
+#
+# For every agenda size, times:
+# - the generation of the .xls file(s), for reference only
+# - ImportAgenda.extract_xls of the file(s)
+# - the import of the file(s) through ImportAgenda, as import_file does
+# - the lookups of sampled existing values, for every column of LookupAgenda.VALID_COLS, through
+#   SQL ('sql') and through the in-memory index ('memory'), and full-text searches of sampled words
+#
+# Results are saved as JSON, and can be compared with the results of a previous run to detect
+# regressions.
+#
+class BenchmarkAgenda:
+
+    DEFAULT_SIZES = (1000, 10000, 100000)
+
+    # Number of lookups timed per column and path
+    DEFAULT_LOOKUPS = 50
+
+    # A metric is reported as a regression when it got slower than the baseline by this factor,
+    # and by more than the noise floor of its unit (timings of sub-millisecond lookups vary a lot)
+    DEFAULT_THRESHOLD = 1.25
+    NOISE_FLOOR = {'_s': 0.05, '_ms': 0.5}
+
+    #
+    # \param workdir        string   directory receiving the generated files and databases
+    # \param lookups        integer  number of lookups timed per column and path
+    # \param seed           integer  random seed of the generated agendas and sampled values
+    # \param agenda_params  dict     GenerateAgenda parameters other than the number of sessions
+    #
+    def __init__(self, workdir, lookups=DEFAULT_LOOKUPS, seed=0, agenda_params=None):
+        self.workdir       = workdir
+        self.lookups       = lookups
+        self.seed          = seed
+        self.agenda_params = agenda_params or {}
+
+    #
+    # Runs the benchmark for every size
+    #
+    # \param sizes  iterable  numbers of sessions of the generated agendas
+    #
+    # \return results, as saved by main: { created, python, sqlite, params, sizes: { size: timings } }
+    #
+    def run(self, sizes):
+        results = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'params': dict(self.agenda_params, lookups=self.lookups, seed=self.seed),
+            'sizes': {}
+        }
+        for size in sizes:
+            results['sizes'][str(size)] = self.run_size(size)
+        return results
+
+    #
+    # Runs the benchmark for a single agenda size
+    #
+    # \param size  integer  number of sessions of the generated agenda
+    #
+    # \return dict of the timings, in seconds for the import steps and milliseconds per lookup
+    #
+    def run_size(self, size):
+        result = {}
+        xls_path = os.path.join(self.workdir, f'agenda_{size}.xls')
+        db_path  = os.path.join(self.workdir, f'agenda_{size}.db')
+
+        start = time.perf_counter()
+        paths = GenerateAgenda(size, seed=self.seed, **self.agenda_params).write(xls_path)
+        result['generate_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for path in paths:
+            ImportAgenda.extract_xls(path)
+        result['extract_xls_s'] = time.perf_counter() - start
+
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        start = time.perf_counter()
+        imported_agenda = ImportAgenda(db_path)
+        rows = itertools.chain.from_iterable(imported_agenda.iter_xls(path) for path in paths)
+        imported_agenda.import_rows(rows, xls_path)
+        imported_agenda.close_conn()
+        result['import_s'] = time.perf_counter() - start
+
+        lookup_agenda = LookupAgenda(db_path)
+        samples = self.sample_values(lookup_agenda)
+        result['sql'] = self.time_lookups(lookup_agenda, samples)
+
+        start = time.perf_counter()
+        memory_agenda = LookupAgenda(db_path, in_memory=True)
+        result['index_build_s'] = time.perf_counter() - start
+        result['memory'] = self.time_lookups(memory_agenda, samples)
+
+        lookup_agenda.close_conn()
+        memory_agenda.close_conn()
+
+        print_result(size, result)
+        return result
+
+    #
+    # Picks existing values to look up: self.lookups values of every VALID_COLS column, and as
+    # many full-text searches of two words of the session titles.
+    #
+    # \return dict mapping each column (and LookupAgenda.TEXT_SEARCH) to its list of values
+    #
+    def sample_values(self, lookup_agenda):
+        rand = random.Random(self.seed)
+        samples = {}
+        for column in sorted(LookupAgenda.VALID_COLS):
+            if column == 'speaker':
+                rows = lookup_agenda.speakers.query("SELECT speaker_name AS value FROM speakers")
+            else:
+                rows = lookup_agenda.sessions.query(f"SELECT DISTINCT {column} AS value FROM sessions")
+            values = [row['value'] for row in rows if row['value']]
+            samples[column] = [rand.choice(values) for _ in range(self.lookups)] if values else []
+
+        words = [word.capitalize() for word in GenerateAgenda.WORDS]
+        samples[LookupAgenda.TEXT_SEARCH] = [f'session_title: ({rand.choice(words)} {rand.choice(words)})'
+                                             for _ in range(self.lookups)]
+        return samples
+
+    #
+    # Times the lookups of the sampled values, one column at a time
+    #
+    # \return dict mapping each column to { 'lookups', 'rows', 'mean_ms', 'p95_ms', 'max_ms' }
+    #
+    def time_lookups(self, lookup_agenda, samples):
+        timings = {}
+        for column, values in samples.items():
+            durations = []
+            rows = 0
+            for value in values:
+                start = time.perf_counter()
+                rows += len(list(lookup_agenda.iter_lookup(column, value)))
+                durations.append((time.perf_counter() - start) * 1000)
+
+            durations.sort()
+            timings[column] = {
+                'lookups': len(durations),
+                'rows': rows,
+                'mean_ms': sum(durations) / len(durations) if durations else 0,
+                'p95_ms': durations[int(len(durations) * 0.95)] if durations else 0,
+                'max_ms': durations[-1] if durations else 0
+            }
+        return timings
+
+
+#
+# Flattens results into { 'size/metric': value } for the timings, e.g.
+# { '1000/import_s': 0.12, '1000/sql/speaker/mean_ms': 0.05, ... }
+#
+def flatten(results):
+    metrics = {}
+    for size, result in results['sizes'].items():
+        for name, value in result.items():
+            if isinstance(value, dict):
+                for column, timing in value.items():
+                    for stat in ('mean_ms', 'p95_ms'):
+                        metrics[f'{size}/{name}/{column}/{stat}'] = timing[stat]
+            elif name != 'generate_s':
+                metrics[f'{size}/{name}'] = value
+    return metrics
+
+
+#
+# Prints the timings of every metric found in both results, flagging the ones slower than
+# threshold times the baseline, see BenchmarkAgenda.NOISE_FLOOR.
+#
+# \param results    dict   results of this run
+# \param baseline   dict   results of a previous run
+# \param threshold  float  slowdown factor considered a regression
+#
+# \return number of regressions
+#
+def compare(results, baseline, threshold):
+    current, previous = flatten(results), flatten(baseline)
+    regressions = 0
+    print(f"\n{'metric':45s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for metric in sorted(current.keys() & previous.keys()):
+        ratio = current[metric] / previous[metric] if previous[metric] else 1.0
+        floor = next(value for unit, value in BenchmarkAgenda.NOISE_FLOOR.items() if metric.endswith(unit))
+        regressed = ratio > threshold and current[metric] - previous[metric] > floor
+        regressions += regressed
+        print(f"{metric:45s} {previous[metric]:10.3f} {current[metric]:10.3f} {ratio:6.2f}x"
+              f"{'  REGRESSION' if regressed else ''}")
+    print(f'\n{regressions} regressions (threshold {threshold:.2f}x)')
+    return regressions
+
+
+#
+# Prints the timings of an agenda size
+#
+def print_result(size, result):
+    print(f"\n{size} sessions: extract_xls {result['extract_xls_s']:.3f}s, import {result['import_s']:.3f}s, "
+          f"in-memory index {result['index_build_s']:.3f}s")
+    for path in ('sql', 'memory'):
+        for column, timing in result[path].items():
+            print(f"    {path:6s} {column:13s} mean {timing['mean_ms']:8.3f}ms  p95 {timing['p95_ms']:8.3f}ms  "
+                  f"({timing['rows']} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(usage='./benchmark_agenda.py [--sizes <count>...] [--output <.json file path>] '
+                                           '[--compare <.json file path>]')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BenchmarkAgenda.DEFAULT_SIZES),
+                        help='numbers of sessions of the generated agendas (default: 1000 10000 100000)')
+    parser.add_argument('--lookups', type=int, default=BenchmarkAgenda.DEFAULT_LOOKUPS,
+                        help=f'lookups timed per column (default: {BenchmarkAgenda.DEFAULT_LOOKUPS})')
+    parser.add_argument('--sub-sessions', type=int, default=2, help='sub-sessions of each session (default: 2)')
+    parser.add_argument('--speakers', type=int, default=2, help='speakers of each session (default: 2)')
+    parser.add_argument('--description-len', type=int, default=30,
+                        help='words of each description (default: 30)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--workdir', default=None,
+                        help='directory receiving the generated files (default: a temporary directory)')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='file receiving the results (default: benchmark_results.json)')
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help='results of a previous run to compare with. exits with an error on regressions')
+    parser.add_argument('--threshold', type=float, default=BenchmarkAgenda.DEFAULT_THRESHOLD,
+                        help=f'slowdown factor reported as a regression (default: {BenchmarkAgenda.DEFAULT_THRESHOLD})')
+    args = parser.parse_args()
+
+    agenda_params = {'sub_sessions': args.sub_sessions, 'speakers': args.speakers,
+                     'description_len': args.description_len}
+    try:
+        if args.workdir:
+            os.makedirs(args.workdir, exist_ok=True)
+            results = BenchmarkAgenda(args.workdir, args.lookups, args.seed, agenda_params).run(args.sizes)
+        else:
+            with tempfile.TemporaryDirectory() as workdir:
+                results = BenchmarkAgenda(workdir, args.lookups, args.seed, agenda_params).run(args.sizes)
+    except RuntimeError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+
+    with open(args.output, 'w') as out:
+        json.dump(results, out, indent=2)
+    print(f'\nResults saved to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline), args.threshold):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
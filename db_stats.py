@@ -0,0 +1,204 @@
+# sqlite statement instrumentation
+import re
+import sys
+import time
+import sqlite3
+
+#
+# Statistics of the statements run through instrumented connections, see db_table.instrument()
+#
+# Statements are grouped by shape: their SQL text with literals replaced by '?' and whitespace
+# collapsed, so that the same query run with different values is counted once. Every shape records
+# its number of executions, the time spent executing it and fetching its rows, and the number of
+# rows fetched.
+#
+# Statements whose execution and fetching took longer than slow_ms are logged as they happen,
+# along with their EXPLAIN QUERY PLAN.
+#
+class QueryStats:
+
+    # Number of shapes listed by summary()
+    SUMMARY_SIZE = 15
+
+    # Literals and whitespace, replaced to compute the shape of a statement
+    SHAPE_PATTERNS = [ (re.compile(r"'(?:[^']|'')*'"), "?"),
+                       (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+                       (re.compile(r"\s+"), " ") ]
+
+    #
+    # \param slow_ms  float  statements taking at least this many milliseconds are logged. None
+    #                        disables the log
+    # \param log      file   stream receiving the slow statements log. defaults to stderr
+    #
+    def __init__(self, slow_ms = None, log = None):
+        self.slow_ms = slow_ms
+        self.log     = log or sys.stderr
+
+        # shape -> [ executions, total seconds, max seconds, rows ]
+        self.shapes = {}
+
+    #
+    # \return shape of the given SQL statement
+    #
+    # Example shape("SELECT * FROM users WHERE id = 42") -> "SELECT * FROM users WHERE id = ?"
+    #
+    @classmethod
+    def shape(cls, query):
+        for pattern, replacement in cls.SHAPE_PATTERNS:
+            query = pattern.sub(replacement, query)
+        return query.strip()
+
+    #
+    # \return the [ executions, total seconds, max seconds, rows ] entry of the given statement
+    #
+    def entry(self, query):
+        shape = self.shape(query)
+        if shape not in self.shapes:
+            self.shapes[shape] = [ 0, 0.0, 0.0, 0 ]
+        return self.shapes[shape]
+
+    #
+    # Logs a slow statement along with its query plan
+    #
+    # \param conn     sqlite3.Connection  connection the statement ran on, used to explain it
+    # \param query    string              SQL statement
+    # \param params   tuple               values bound to the statement
+    # \param elapsed  float               seconds spent on the statement so far
+    #
+    def log_slow(self, conn, query, params, elapsed):
+        print("slow query (%.1f ms): %s" % (elapsed * 1000, self.shape(query)), file=self.log)
+        if query.lstrip()[:7].upper() in ("EXPLAIN", "PRAGMA "):
+            return
+
+        try:
+            # explained on a plain cursor, so that it is not instrumented itself
+            plan = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        except sqlite3.Error as e:
+            print("    (no query plan: %s)" % e, file=self.log)
+            return
+        for row in plan:
+            print("    %s" % row[3], file=self.log)
+
+    #
+    # \return printable summary: totals, then the shapes taking the most time
+    #
+    def summary(self):
+        executions = sum(entry[0] for entry in self.shapes.values())
+        total      = sum(entry[1] for entry in self.shapes.values())
+        rows       = sum(entry[3] for entry in self.shapes.values())
+        lines = [ "%d statements (%d shapes), %.1f ms, %d rows fetched"
+                  % (executions, len(self.shapes), total * 1000, rows) ]
+
+        lines.append("%8s %10s %9s %9s %8s  %s" % ("count", "total ms", "mean ms", "max ms", "rows", "statement"))
+        by_time = sorted(self.shapes.items(), key=lambda item: item[1][1], reverse=True)
+        for shape, (count, seconds, max_seconds, shape_rows) in by_time[:self.SUMMARY_SIZE]:
+            lines.append("%8d %10.2f %9.3f %9.3f %8d  %s" % (count, seconds * 1000, seconds * 1000 / count,
+                                                            max_seconds * 1000, shape_rows, shape[:120]))
+        return "\n".join(lines)
+
+    #
+    # Prints the summary to the log stream, e.g. registered with atexit by the command line tools
+    #
+    def print_summary(self):
+        print("\nSQL statistics: " + self.summary(), file=self.log)
+
+
+#
+# Cursor recording its statements into the QueryStats of its connection.
+# The time of a statement includes the fetching of its rows, so that the lazily evaluated
+# queries (e.g. the db_table.iter_* generators) are accounted for as a whole.
+#
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def execute(self, query, params = ()):
+        self.begin(query, params, 1)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            self.track(start)
+
+    def executemany(self, query, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self.begin(query, seq_of_params[0] if seq_of_params else (), len(seq_of_params))
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, seq_of_params)
+        finally:
+            self.track(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.track(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size = None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.track(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.track(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.track(start)
+            raise
+        self.track(start, 1)
+        return row
+
+    #
+    # Starts recording a new statement
+    #
+    def begin(self, query, params, executions):
+        self.stats_entry  = self.connection.stats.entry(query)
+        self.stats_entry[0] += executions
+        self.stats_query  = (query, params)
+        self.stats_time   = 0.0
+        self.stats_logged = False
+
+    #
+    # Records the time spent since start, and the fetched rows, into the current statement
+    #
+    def track(self, start, rows = 0):
+        elapsed = time.perf_counter() - start
+        entry = getattr(self, "stats_entry", None)
+        if entry is None:
+            return
+
+        self.stats_time += elapsed
+        entry[1] += elapsed
+        entry[2]  = max(entry[2], self.stats_time)
+        entry[3] += rows
+
+        stats = self.connection.stats
+        if stats.slow_ms is not None and not self.stats_logged and self.stats_time * 1000 >= stats.slow_ms:
+            self.stats_logged = True
+            stats.log_slow(self.connection, *self.stats_query, self.stats_time)
+
+
+#
+# Connection whose statements are all run through InstrumentedCursor, see db_table.instrument()
+#
+class InstrumentedConnection(sqlite3.Connection):
+
+    # QueryStats receiving the statistics, set once connected
+    stats = None
+
+    def cursor(self, factory = InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute* do not go through cursor().execute*, hence the overrides
+    def execute(self, query, params = ()):
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, seq_of_params):
+        return self.cursor().executemany(query, seq_of_params)
@@ -1,5 +1,8 @@
 # sqlite db communication
 import sqlite3
+import pathlib
+import threading
+from db_stats import QueryStats, InstrumentedConnection
 
 #
 # Very basic SQLite wrapper
@@ -10,23 +13,125 @@ import sqlite3
 # If you need to change the schema of an already created table, reset the database
 # If you need to reset the database, just delete the database file (db_table.DB_NAME)
 #
+# Tables bound to the same database file share a single connection (per thread), see connect()
+#
 class db_table:
 
-    # SQLite database filename
+    # Default SQLite database filename
     DB_NAME = "interview_test.db"
 
+    # Number of compiled statements kept by each sqlite connection. Since values are always bound as
+    # parameters, the SQL text of a given query shape never changes and is compiled only once
+    STATEMENT_CACHE_SIZE = 256
+
+    # Number of rows fetched at once by the iter_* generators
+    FETCH_SIZE = 256
+
+    # Row modes of the iter_* generators: "dict" yields { col1: val1, ... }, "tuple" yields the raw
+    # (val1, val2, ...) tuples and "row" yields sqlite3.Row objects (indexable by position and name)
+    ROW_MODES = { "dict", "tuple", "row" }
+
+    # Shared connections, mapping (database path, thread id, read only) to [ connection, reference count ]
+    # sqlite connections can only be used from the thread that created them, hence the thread id
+    _connections      = {}
+    _connections_lock = threading.Lock()
+
+    # QueryStats of the instrumented connections, None unless instrument() was called
+    stats = None
+
+    #
+    # Enable the instrumentation of the connections opened from now on: every statement is timed
+    # and counted by shape into a QueryStats, and the slow ones are logged with their query plan.
+    # Meant to be called before any table is created, e.g. from a command line flag.
+    #
+    # \param slow_ms  float  statements taking at least this many milliseconds are logged. None
+    #                        disables the log
+    # \param log      file   stream receiving the log and summary. defaults to stderr
+    #
+    # \return QueryStats receiving the statistics
+    #
+    # Example stats = db_table.instrument(slow_ms=50)
+    #         ...
+    #         print(stats.summary())
+    #
+    @classmethod
+    def instrument(cls, slow_ms = None, log = None):
+        cls.stats = QueryStats(slow_ms, log)
+        return cls.stats
+
+    #
+    # Get the shared connection to the given database
+    # opens it on first use, and counts references so that it is only closed once every user
+    # released it through disconnect()
+    #
+    # \param db_path    string   path to the SQLite database file. defaults to DB_NAME
+    # \param read_only  boolean  whether to open the database read only (mode=ro). read only
+    #                            connections are shared separately from the read-write ones
+    #
+    # \return sqlite3.Connection
+    #
+    # Example conn = db_table.connect("event.db")
+    #         ...
+    #         db_table.disconnect("event.db")
+    #
+    @classmethod
+    def connect(cls, db_path = None, read_only = False):
+        key = (db_path or cls.DB_NAME, threading.get_ident(), read_only)
+        with cls._connections_lock:
+            if key not in cls._connections:
+                # a read only connection fails to open rather than creating a missing database
+                target = pathlib.Path(key[0]).resolve().as_uri() + "?mode=ro" if read_only else key[0]
+                if cls.stats is None:
+                    conn = sqlite3.connect(target, cached_statements=cls.STATEMENT_CACHE_SIZE, uri=read_only)
+                else:
+                    conn = sqlite3.connect(target, cached_statements=cls.STATEMENT_CACHE_SIZE, uri=read_only,
+                                           factory=InstrumentedConnection)
+                    conn.stats = cls.stats
+                cls._connections[key] = [ conn, 0 ]
+            cls._connections[key][1] += 1
+            return cls._connections[key][0]
+
+    #
+    # Release a reference to the shared connection to the given database
+    # the connection is closed once no reference is left
+    #
+    # \param db_path    string   path to the SQLite database file. defaults to DB_NAME
+    # \param read_only  boolean  whether the connection is the read only one, see connect()
+    #
+    @classmethod
+    def disconnect(cls, db_path = None, read_only = False):
+        key = (db_path or cls.DB_NAME, threading.get_ident(), read_only)
+        with cls._connections_lock:
+            if key not in cls._connections:
+                return
+            cls._connections[key][1] -= 1
+            if cls._connections[key][1] <= 0:
+                cls._connections.pop(key)[0].close()
+
     #
     # model initialization
     # records table name and schema
     # creates the table if it does not exist yet in DB
     #
-    # \param name    string                name of the DB table
-    # \param schema  dict<string, string>  schema of DB table, mapping column name to their DB
-    #                                      type & constraint
+    # \param name     string                name of the DB table
+    # \param schema   dict<string, string>  schema of DB table, mapping column name to their DB
+    #                                       type & constraint
+    # \param indexes  dict<string, string>  indexes of DB table, mapping index suffix to the indexed
+    #                                       column(s) or expression(s). indexes are not created with
+    #                                       the table, call create_indexes() once data is loaded
+    # \param db_path  string                path to the SQLite database file. defaults to DB_NAME
+    # \param module   string                if set, the table is a virtual table implemented by that
+    #                                       module (e.g. "fts5"). schema values are then the column
+    #                                       options of the module, usually empty
+    # \param read_only boolean               whether to use a read only connection, see connect().
+    #                                       the table must then already exist
     #
     # Example: table("users", { "id": "integer PRIMARY KEY", "name": "text" })
+    #          table("users", { "id": "integer PRIMARY KEY", "name": "text" },
+    #                { "lower_name": "lower(name)" }, "event.db")
+    #          table("users_fts", { "name": "" }, module="fts5")
     #
-    def __init__(self, name, schema):
+    def __init__(self, name, schema, indexes = None, db_path = None, module = None, read_only = False):
         # error handling
         if not name:
             raise RuntimeError("invalid table name")
@@ -36,28 +141,151 @@ class db_table:
         # init fields and initiate database connection
         self.name    = name
         self.schema  = schema
-        self.db_conn = sqlite3.connect(self.DB_NAME)
-        
-        # ensure the table is created
-        self.create_table()
+        self.indexes = indexes or {}
+        self.module  = module
+        self.read_only = read_only
+
+        # generated SQL, keyed by query shape (operation, columns, where columns), see sql()
+        self.sql_cache = {}
+
+        self.db_path = db_path or self.DB_NAME
+        self.db_conn = self.connect(self.db_path, self.read_only)
+
+        # ensure the table is created, recording whether it had to be (e.g. to backfill it)
+        self.created = self.create_table()
 
     #
     # CREATE TABLE IF NOT EXISTS wrapper
     # Create the database table based on self.name and self.schema
     # If table already exists, nothing is done even if the schema has changed
     # If you need to apply schema changes, please delete the database file
+    # The creation is committed, unless it is part of a transaction opened by the caller
+    #
+    # \return True if the table was created, False if it already existed
+    #
+    # \error RuntimeError is thrown if the table does not exist and the connection is read only
     #
     def create_table(self):
+        # the existence check is a plain read, avoiding a write transaction and commit when the
+        # table is already there (i.e. on every lookup)
+        exists = self.db_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.name,)).fetchone()
+        if exists:
+            return False
+        if self.read_only:
+            raise RuntimeError("table %s does not exist in read only database %s" % (self.name, self.db_path))
+
+        in_transaction = self.db_conn.in_transaction
+
         # { "id": "integer", "name": "text" } -> "id integer, name text"
-        columns_query_string = ', '.join([ "%s %s" % (k,v) for k,v in self.schema.items() ])
+        columns_query_string = ', '.join([ ("%s %s" % (k,v)).strip() for k,v in self.schema.items() ])
 
         # CREATE TABLE IF NOT EXISTS users (id integer PRIMARY KEY, name text)
+        # CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(name)
         #
         # Note that columns are formatted into the string without using sqlite safe substitution mechanism
         # The reason is that sqlite does not provide substitution mechanism for columns parameters
         # In the context of this project, this is fine (no risk of user malicious input)
-        self.db_conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (self.name, columns_query_string))
-        self.db_conn.commit()
+        if self.module:
+            self.db_conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING %s(%s)"
+                                 % (self.name, self.module, columns_query_string))
+        else:
+            self.db_conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (self.name, columns_query_string))
+        if not in_transaction:
+            self.db_conn.commit()
+        return True
+
+    #
+    # CREATE INDEX IF NOT EXISTS wrapper
+    # Create the indexes declared for this table, named "<table>_<suffix>"
+    # Building indexes once after a bulk load is a lot cheaper than maintaining them on every insert
+    # The creation is committed, unless it is part of a transaction opened by the caller
+    #
+    # Example table.create_indexes()  # CREATE INDEX IF NOT EXISTS users_lower_name ON users (lower(name))
+    #
+    def create_indexes(self):
+        in_transaction = self.db_conn.in_transaction
+        for suffix, columns in self.indexes.items():
+            self.db_conn.execute("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)"
+                                 % (self.name, suffix, self.name, columns))
+        if not in_transaction:
+            self.db_conn.commit()
+
+    #
+    # DROP INDEX IF EXISTS wrapper
+    # Drop the indexes declared for this table, e.g. before a bulk load
+    #
+    def drop_indexes(self):
+        with self.db_conn:
+            for suffix in self.indexes:
+                self.db_conn.execute("DROP INDEX IF EXISTS %s_%s" % (self.name, suffix))
+
+    #
+    # EXPLAIN QUERY PLAN wrapper
+    # Returns how sqlite plans to run the given query
+    #
+    # \param query   string         SQL query to explain
+    # \param params  array<string>  values bound to the '?' placeholders of the query
+    #
+    # \return array of the plan steps, e.g. [ "SEARCH users USING INDEX users_lower_name (<expr>=?)" ]
+    #
+    def explain(self, query, params = ()):
+        return [ row[3] for row in self.db_conn.execute("EXPLAIN QUERY PLAN " + query, params) ]
+
+    #
+    # Checks whether the given query is answered through indexes only
+    #
+    # \param query   string         SQL query to check
+    # \param params  array<string>  values bound to the '?' placeholders of the query
+    #
+    # \return True if no step of the query plan is a full table scan
+    #
+    def uses_index(self, query, params = ()):
+        return not any(step.startswith("SCAN") for step in self.explain(query, params))
+
+    #
+    # Generated SQL cache
+    # returns the SQL of the given query shape, only building it the first time that shape is seen
+    # values are never part of the SQL (they are bound as parameters), so a shape always maps to
+    # the same SQL, which also lets the sqlite statement cache skip re-parsing it
+    #
+    # \param key    tuple     query shape, e.g. ("select", ("id",), ("name",))
+    # \param build  function  builds the SQL string for that shape
+    #
+    # \return SQL string
+    #
+    def sql(self, key, build):
+        query = self.sql_cache.get(key)
+        if query is None:
+            query = self.sql_cache[key] = build()
+        return query
+
+    #
+    # Database generation
+    # a counter stored in the database header (PRAGMA user_version), bumped by writers every time
+    # the data changes, so that readers can cheaply tell whether anything they cached is stale
+    #
+    # \return current generation of the database
+    #
+    def generation(self):
+        return self.db_conn.execute("PRAGMA user_version").fetchone()[0]
+
+    #
+    # Increment the database generation, see generation()
+    #
+    # \param commit  boolean  whether to commit. if False, the new generation is part of the
+    #                         ongoing transaction and only becomes visible with its data
+    #
+    # \return new generation of the database
+    #
+    def bump_generation(self, commit = True):
+        generation = self.generation() + 1
+
+        # PRAGMA does not support parameters, the value is an integer we computed
+        self.db_conn.execute("PRAGMA user_version = %d" % generation)
+        if commit:
+            self.db_conn.commit()
+        return generation
 
     #
     # SELECT wrapper
@@ -78,30 +306,51 @@ class db_table:
         if not columns:
             columns = [ k for k in self.schema ]
 
+        return list(self.iter_select(columns, where))
+
+    #
+    # Streaming SELECT wrapper
+    # same as select(), but yields the rows as they are fetched from the database (FETCH_SIZE rows
+    # at a time) instead of building the whole result first
+    #
+    # \param columns     array<string>         columns to be fetched. if empty, will query all the columns
+    # \param where       dict<string, string>  where filters to be applied. only combine them using AND
+    #                                          and only check for strict equality
+    # \param row_mode    string                format of the yielded rows, one of ROW_MODES
+    # \param fetch_size  integer               number of rows fetched at once. defaults to FETCH_SIZE
+    #
+    # \return generator of rows, { col1: val1, col2: val2, col3: val3 } in "dict" mode
+    #
+    # Example for row in table.iter_select(["name"], row_mode="tuple"): print(row[0])
+    #
+    def iter_select(self, columns = [], where = {}, row_mode = "dict", fetch_size = None):
+        # by default, query all columns
+        if not columns:
+            columns = [ k for k in self.schema ]
+
+        query = self.sql(("select", tuple(columns), tuple(where)),
+                         lambda: self.select_sql(columns, where))
+        return self.iter_rows(query, tuple(where.values()), columns, row_mode, fetch_size)
+
+    #
+    # Build the SQL of a select() call
+    #
+    # \return SQL string, e.g. SELECT id, name FROM users WHERE id = ? AND name = ?
+    #
+    def select_sql(self, columns, where):
         # build query string
         columns_query_string = ", ".join(columns)
         query                = "SELECT %s FROM %s" % (columns_query_string, self.name)
 
         # build where query string
         if where:
-            where_query_string = [ "%s = '%s'" % (k,v) for k,v in where.items() ]
+            where_query_string = [ "%s = ?" % k for k in where ]
             query             += " WHERE " + ' AND '.join(where_query_string)
-        
-        result = []
 
-        # SELECT id, name FROM users [ WHERE id=42 AND name=John ]
-        #
         # Note that columns are formatted into the string without using sqlite safe substitution mechanism
         # The reason is that sqlite does not provide substitution mechanism for columns parameters
         # In the context of this project, this is fine (no risk of user malicious input)
-        for row in self.db_conn.execute(query):
-            result_row = {}
-            # convert from (val1, val2, val3) to { col1: val1, col2: val2, col3: val3 }
-            for i in range(0, len(columns)):
-                result_row[columns[i]] = row[i]
-            result.append(result_row)
-
-        return result
+        return query
 
     #
     # SELECT JOIN wrapper
@@ -121,27 +370,123 @@ class db_table:
     #         table.select_join("speakers", "id", "session_id", where={ "speakers.speaker": "John" })
     #
     def select_join(self, other_db, left, right, columns = [], where = {}):
+        return list(self.iter_select_join(other_db, left, right, columns, where))
+
+    #
+    # Streaming SELECT JOIN wrapper
+    # same as select_join(), but yields the rows as they are fetched from the database
+    # (FETCH_SIZE rows at a time) instead of building the whole result first
+    #
+    # \param row_mode    string   format of the yielded rows, one of ROW_MODES
+    # \param fetch_size  integer  number of rows fetched at once. defaults to FETCH_SIZE
+    #
+    # \return generator of rows, { col1: val1, col2: val2, ... } in "dict" mode
+    #
+    # Example for row in table.iter_select_join("speakers", "id", "session_id", row_mode="row"): ...
+    #
+    def iter_select_join(self, other_db, left, right, columns = [], where = {}, row_mode = "dict",
+                         fetch_size = None):
         # by default, query all columns
         if not columns:
             columns = list(self.schema.keys())
-        
+
+        query = self.sql(("select_join", other_db, left, right, tuple(columns), tuple(where)),
+                         lambda: self.select_join_sql(other_db, left, right, columns, where))
+        return self.iter_rows(query, tuple(where.values()), columns, row_mode, fetch_size)
+
+    #
+    # Build the SQL of a select_join() call
+    #
+    # \return SQL string, e.g. SELECT date FROM sessions JOIN speakers ON sessions.id = speakers.session_id
+    #                          WHERE speakers.speaker = ?
+    #
+    def select_join_sql(self, other_db, left, right, columns, where):
         # build query string
         columns_query_string = ", ".join(columns)
         query = f"SELECT {columns_query_string} FROM {self.name} JOIN {other_db} ON {self.name}.{left} = {other_db}.{right}"
-        
+
         # build where query string
         if where:
-            where_query_string = [ "%s = '%s'" % (k, v) for k, v in where.items() ]
+            where_query_string = [ "%s = ?" % k for k in where ]
             query += " WHERE " + " AND ".join(where_query_string)
+        return query
 
-        result = []
+    #
+    # Raw SELECT wrapper
+    # runs a hand written query for the cases the other wrappers cannot express
+    # (e.g. recursive CTEs), binding the values through sqlite safe substitution mechanism
+    #
+    # \param query   string         SQL query to run
+    # \param params  array<string>  values bound to the '?' placeholders of the query
+    #
+    # \return [ { col1: val1, col2: val2, ... } ], keyed by the column names of the result
+    #
+    # Example table.query("SELECT id FROM users WHERE lower(name) = ?", ["john"])
+    #
+    def query(self, query, params = ()):
+        return list(self.iter_query(query, params))
 
-        for row in self.db_conn.execute(query):
-            result_row = {}
-            for i, col in enumerate(columns):
-                result_row[col] = row[i]
-            result.append(result_row)
-        return result
+    #
+    # Streaming raw SELECT wrapper
+    # same as query(), but yields the rows as they are fetched from the database
+    #
+    # \param row_mode    string   format of the yielded rows, one of ROW_MODES
+    # \param fetch_size  integer  number of rows fetched at once. defaults to FETCH_SIZE
+    #
+    # \return generator of rows, keyed by the column names of the result in "dict" mode
+    #
+    def iter_query(self, query, params = (), row_mode = "dict", fetch_size = None):
+        return self.iter_rows(query, params, None, row_mode, fetch_size)
+
+    #
+    # Runs the given query and yields its rows, fetching them in chunks
+    # The query is run when this function is called (not on first iteration) so that errors surface
+    # right away, the rows are then read lazily as the caller iterates.
+    #
+    # \param query       string         SQL query to run
+    # \param params      array<string>  values bound to the '?' placeholders of the query
+    # \param columns     array<string>  keys of the yielded dicts. if None, the result column names are used
+    # \param row_mode    string         format of the yielded rows, one of ROW_MODES
+    # \param fetch_size  integer        number of rows fetched at once. defaults to FETCH_SIZE
+    #
+    # \return generator of rows
+    #
+    def iter_rows(self, query, params, columns, row_mode, fetch_size):
+        if row_mode not in self.ROW_MODES:
+            raise RuntimeError("invalid row mode: %s" % row_mode)
+
+        cursor = self.db_conn.cursor()
+        if row_mode == "row":
+            cursor.row_factory = sqlite3.Row
+        cursor.execute(query, params)
+
+        if columns is None:
+            columns = [ description[0] for description in cursor.description ]
+        return self.fetch_rows(cursor, columns, row_mode, fetch_size or self.FETCH_SIZE)
+
+    #
+    # Generator reading the rows of an executed cursor, fetch_size rows at a time
+    #
+    def fetch_rows(self, cursor, columns, row_mode, fetch_size):
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+
+                if row_mode == "dict":
+                    # convert from (val1, val2, val3) to { col1: val1, col2: val2, col3: val3 }
+                    for row in rows:
+                        yield dict(zip(columns, row))
+                else:
+                    yield from rows
+        finally:
+            # an abandoned generator may only be finalized after the connection was closed,
+            # closing the connection having released the cursor already
+            try:
+                cursor.close()
+            except sqlite3.ProgrammingError:
+                pass
 
     #
     # INSERT INTO wrapper
@@ -154,19 +499,90 @@ class db_table:
     # Example table.insert({ "id": "42", "name": "John" })
     #
     def insert(self, item):
-        # build columns & values queries
-        columns_query = ", ".join(item.keys())
-        values_query  = ", ".join([ "'%s'" % v for v in item.values()])
-        
-        # Note that columns are formatted into the string without using sqlite safe substitution mechanism
-        # The reason is that sqlite does not provide substitution mechanism for columns parameters
-        # In the context of this project, this is fine (no risk of user malicious input)
+        query = self.sql(("insert", tuple(item)), lambda: self.insert_sql(list(item)))
+
         cursor = self.db_conn.cursor()
-        cursor.execute("INSERT INTO %s (%s) VALUES (%s)" % (self.name, columns_query, values_query))
+        cursor.execute(query, tuple(item.values()))
         cursor.close()
         self.db_conn.commit()
         return cursor.lastrowid
 
+    #
+    # Build the SQL of an insert() or insert_many() call
+    #
+    # \return SQL string, e.g. INSERT INTO users (id, name) VALUES (?, ?)
+    #
+    def insert_sql(self, columns):
+        # Note that columns are formatted into the string without using sqlite safe substitution mechanism
+        # The reason is that sqlite does not provide substitution mechanism for columns parameters
+        # In the context of this project, this is fine (no risk of user malicious input)
+        return "INSERT INTO %s (%s) VALUES (%s)" % (self.name, ", ".join(columns),
+                                                    ", ".join([ "?" ] * len(columns)))
+
+    #
+    # Bulk INSERT INTO wrapper
+    # insert all the given items into database using a single executemany call and a single
+    # transaction, instead of one statement and one commit per item
+    #
+    # All items must share the same set of columns (the columns of the first item are used).
+    # If id_column is given and the items do not provide it, ids are assigned sequentially
+    # after the current maximum id of the table, within the same transaction.
+    #
+    # \param items      array<dict<string, string>>  items to be inserted in DB, mapping column to value
+    # \param id_column  string                       primary key column of the table, used to
+    #                                                compute the ids of the created records
+    # \param commit     boolean                      whether to commit the batch. if False, the batch is
+    #                                                left in the ongoing transaction, letting the caller
+    #                                                group several batches into one transaction
+    #
+    # \return array of the ids of the created records (empty if id_column is not provided)
+    #
+    # Example table.insert_many([{ "name": "John" }, { "name": "Jane" }], "id")
+    #
+    def insert_many(self, items, id_column = None, commit = True):
+        if not items:
+            return []
+
+        columns = list(items[0].keys())
+        ids     = []
+
+        if id_column and id_column not in columns:
+            ids   = self.next_ids(len(items), id_column)
+            items = [ dict(item, **{ id_column: i }) for item, i in zip(items, ids) ]
+            columns.append(id_column)
+        elif id_column:
+            ids = [ item[id_column] for item in items ]
+
+        query = self.sql(("insert", tuple(columns)), lambda: self.insert_sql(columns))
+
+        values = [ tuple(item[c] for c in columns) for item in items ]
+        if not commit:
+            self.db_conn.executemany(query, values)
+            return ids
+
+        # with block commits the whole batch at once, or rolls it back on error
+        with self.db_conn:
+            self.db_conn.executemany(query, values)
+
+        return ids
+
+    #
+    # Reserve the next ids of the table
+    # returns the ids that the next inserted records will get, so that callers can link records
+    # together (e.g. sub-sessions to their main session) before bulk inserting them
+    #
+    # \param count      integer  number of ids to reserve
+    # \param id_column  string   primary key column of the table
+    #
+    # \return array of count consecutive ids, starting after the current maximum id
+    #
+    # Example table.next_ids(3) -> [ 43, 44, 45 ]
+    #
+    def next_ids(self, count, id_column = "id"):
+        next_id = self.db_conn.execute(
+            "SELECT IFNULL(MAX(%s), 0) + 1 FROM %s" % (id_column, self.name)).fetchone()[0]
+        return list(range(next_id, next_id + count))
+
     #
     # UPDATE wrapper
     # update multiple rows matching the specified condition
@@ -180,23 +596,98 @@ class db_table:
     # Example table.update({ "name": "Simon" }, { "id": 42 })
     #
     def update(self, values, where):
-        # build set & where queries
-        set_query   = ", ".join(["%s = '%s'" % (k,v) for k,v in values.items()])
-        where_query = " AND ".join(["%s = '%s'" % (k,v) for k,v in where.items()])
+        query = self.sql(("update", tuple(values), tuple(where)), lambda: self.update_sql(values, where))
+
+        cursor = self.db_conn.cursor()
+        cursor.execute(query, tuple(values.values()) + tuple(where.values()))
+        cursor.close()
+        self.db_conn.commit()
+        return cursor.rowcount
+
+    #
+    # Bulk UPDATE wrapper
+    # update each given item, identified by its key column, using a single executemany call and a
+    # single transaction
+    #
+    # All items must share the same set of columns (the columns of the first item are used).
+    #
+    # \param items       array<dict<string, string>>  items to be updated, mapping column to value.
+    #                                                 must include key_column
+    # \param key_column  string                       column identifying the record to update
+    # \param commit      boolean                      whether to commit the batch. if False, the batch is
+    #                                                 left in the ongoing transaction, see insert_many
+    #
+    # \return number of updated records
+    #
+    # Example table.update_many([{ "id": 42, "name": "Simon" }, { "id": 43, "name": "John" }])
+    #
+    def update_many(self, items, key_column = "id", commit = True):
+        if not items:
+            return 0
+
+        values = { column: None for column in items[0] if column != key_column }
+        where  = { key_column: None }
+        query  = self.sql(("update", tuple(values), tuple(where)), lambda: self.update_sql(values, where))
+
+        params = [ tuple(item[c] for c in values) + (item[key_column],) for item in items ]
+        if not commit:
+            return self.db_conn.executemany(query, params).rowcount
 
-        # UPDATE users SET name = Simon WHERE id = 42
+        with self.db_conn:
+            cursor = self.db_conn.executemany(query, params)
+        return cursor.rowcount
+
+    #
+    # Bulk DELETE wrapper
+    # delete all the records whose column matches one of the given values, using a single
+    # executemany call and a single transaction
+    #
+    # \param column  string         column to be checked for strict equality
+    # \param values  array<string>  values of the records to be deleted
+    # \param commit  boolean        whether to commit the batch. if False, the batch is left in the
+    #                               ongoing transaction, see insert_many
+    #
+    # \return number of deleted records
+    #
+    # Example table.delete_many("id", [ 42, 43 ])
+    #
+    def delete_many(self, column, values, commit = True):
+        if not values:
+            return 0
+
+        # DELETE FROM users WHERE id = ?
         #
         # Note that columns are formatted into the string without using sqlite safe substitution mechanism
         # The reason is that sqlite does not provide substitution mechanism for columns parameters
         # In the context of this project, this is fine (no risk of user malicious input)
-        cursor = self.db_conn.cursor()
-        cursor.execute("UPDATE %s SET %s WHERE %s" % (self.name, set_query, where_query))
-        cursor.close()
-        self.db_conn.commit()
+        query = self.sql(("delete", column), lambda: "DELETE FROM %s WHERE %s = ?" % (self.name, column))
+
+        params = [ (value,) for value in values ]
+        if not commit:
+            return self.db_conn.executemany(query, params).rowcount
+
+        with self.db_conn:
+            cursor = self.db_conn.executemany(query, params)
         return cursor.rowcount
 
+    #
+    # Build the SQL of an update() call
+    #
+    # \return SQL string, e.g. UPDATE users SET name = ? WHERE id = ?
+    #
+    def update_sql(self, values, where):
+        # build set & where queries
+        set_query   = ", ".join(["%s = ?" % k for k in values])
+        where_query = " AND ".join(["%s = ?" % k for k in where])
+
+        # Note that columns are formatted into the string without using sqlite safe substitution mechanism
+        # The reason is that sqlite does not provide substitution mechanism for columns parameters
+        # In the context of this project, this is fine (no risk of user malicious input)
+        return "UPDATE %s SET %s WHERE %s" % (self.name, set_query, where_query)
+
     #
     # Close the database connection
+    # the connection is only closed once every table sharing it has been closed
     #
     def close(self):
-        self.db_conn.close()
+        self.disconnect(self.db_path, self.read_only)
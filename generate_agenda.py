@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import os
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# xlwt is only needed to generate agendas, not to import or look them up
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+#
+# Generates synthetic agenda .xls files, in the format expected by import_agenda.py, to measure
+# the import and lookups at scale (see benchmark_agenda.py).
+#
+# The agenda format only has one level of sub-sessions (a 'Sub' row belongs to the session above
+# it), so the shape of the agenda is controlled by the number of sub-sessions per session.
+# Every session gets a unique title, so that generated files never contain duplicate rows.
+#
+class GenerateAgenda:
+
+    # Header row of the agenda, as in the Whova template
+    HEADERS = ('*Date', '*Time Start', '*Time End', '*Session or \nSub-session(Sub)', '*Session Title',
+               'Room/Location', 'Description', 'Speakers')
+
+    # Rows before the header row, see ImportAgenda.NUM_ROWS_TO_SKIP
+    NUM_ROWS_TO_SKIP = 14
+
+    # .xls sheets are limited to 65536 rows, larger agendas are split into several files
+    MAX_ROWS_PER_FILE = 65536 - NUM_ROWS_TO_SKIP - 1
+
+    # Length of a session, and of each of its sub-sessions
+    SLOT_MINUTES = 30
+
+    # Sessions running at the same time, each one in its own room
+    ROOMS_PER_SLOT = 8
+
+    WORDS = ('cloud', 'memory', 'system', 'parallel', 'compiler', 'network', 'storage', 'security',
+             'hardware', 'energy', 'scheduling', 'learning', 'graph', 'cache', 'virtualization',
+             'consistency', 'accelerator', 'database', 'kernel', 'distributed', 'performance',
+             'analysis', 'design', 'workload', 'architecture', 'reliability', 'transaction', 'mobile')
+
+    FIRST_NAMES = ('Anna', 'Diana', 'Jeremy', 'Sarah', 'Yen', 'Luis', 'David', 'Keshav', 'Maria',
+                   'Wei', 'Priya', 'Omar', 'Elena', 'Kenji', 'Fatima', 'Lucas', 'Nora', 'Ivan')
+
+    LAST_NAMES = ('Marshall', 'Tin', 'Jones', 'Tran', 'Brown', 'Ceze', 'Wood', 'Pingali', 'Garcia',
+                  'Chen', 'Patel', 'Haddad', 'Petrova', 'Sato', 'Khan', 'Silva', 'Berg', 'Novak')
+
+    #
+    # \param sessions         integer  total number of rows (sessions and sub-sessions)
+    # \param sub_sessions     integer  number of sub-sessions following each session
+    # \param speakers         integer  number of speakers of each session
+    # \param description_len  integer  number of words of each description
+    # \param speaker_pool     integer  number of distinct speakers. defaults to a speaker for
+    #                                  every 4 sessions, so that speakers have several sessions
+    # \param seed             integer  random seed, the same parameters and seed always generate
+    #                                  the same agenda
+    #
+    def __init__(self, sessions, sub_sessions=2, speakers=2, description_len=30, speaker_pool=None,
+                 seed=0):
+        self.sessions        = sessions
+        self.sub_sessions    = sub_sessions
+        self.speakers        = speakers
+        self.description_len = description_len
+        self.speaker_pool    = speaker_pool or max(sessions // 4, speakers, 1)
+        self.random          = random.Random(seed)
+
+    #
+    # Generates the agenda rows, a session being directly followed by its sub-sessions.
+    # Sessions are laid out in time slots of ROOMS_PER_SLOT parallel sessions, from 8 AM to 6 PM
+    # on consecutive days, sub-sessions splitting the time slot of their session.
+    #
+    # \return generator of rows ordered as HEADERS
+    #
+    def iter_rows(self):
+        slots_per_day = (10 * 60) // self.SLOT_MINUTES
+        sub_minutes = self.SLOT_MINUTES // max(self.sub_sessions, 1)
+        first_day = datetime(2018, 6, 16, 8, 0)
+
+        count = 0
+        session_num = 0
+        while count < self.sessions:
+            slot, room = divmod(session_num, self.ROOMS_PER_SLOT)
+            day, slot = divmod(slot, slots_per_day)
+            start = first_day + timedelta(days=day, minutes=slot * self.SLOT_MINUTES)
+            location = f'Room {room + 1}'
+
+            yield self.row(start, self.SLOT_MINUTES, 'Session', f'Session {session_num + 1}', location)
+            count += 1
+
+            for sub_num in range(min(self.sub_sessions, self.sessions - count)):
+                sub_start = start + timedelta(minutes=sub_num * sub_minutes)
+                yield self.row(sub_start, sub_minutes, 'Sub', f'Session {session_num + 1}.{sub_num + 1}',
+                               f'{location}, Table {sub_num + 1}')
+                count += 1
+
+            session_num += 1
+
+    #
+    # \return an agenda row ordered as HEADERS
+    #
+    def row(self, start, minutes, session_type, title, location):
+        end = start + timedelta(minutes=minutes)
+        topic = ' '.join(self.random.choice(self.WORDS).capitalize() for _ in range(3))
+        description = ' '.join(self.random.choice(self.WORDS) for _ in range(self.description_len))
+        speakers = '; '.join(self.speaker_name(self.random.randrange(self.speaker_pool))
+                             for _ in range(self.speakers))
+        return (start.strftime('%m/%d/%Y'), start.strftime('%I:%M %p'), end.strftime('%I:%M %p'),
+                session_type, f'{title}: {topic}', location, description, speakers)
+
+    #
+    # \return the name of the n-th speaker of the pool
+    #
+    def speaker_name(self, n):
+        first, last = divmod(n, len(self.LAST_NAMES))
+        first, suffix = divmod(first, len(self.FIRST_NAMES))
+        name = f'{self.FIRST_NAMES[suffix]} {self.LAST_NAMES[last]}'
+        return name if first == 0 else f'{name} {first + 1}'
+
+    #
+    # Writes the agenda to one or several .xls files. Files are split between two sessions, never
+    # between a session and its sub-sessions, so that each file is a valid agenda and importing
+    # them in order (see import_agenda.py) yields the whole agenda.
+    #
+    # \param path           string   path of the .xls file. when split, files are named
+    #                                <path without .xls>_<n>.xls
+    # \param rows_per_file  integer  maximum number of rows of each file
+    #
+    # \return List of the written file paths
+    #
+    # \error RuntimeError is thrown if xlwt is not installed
+    #
+    def write(self, path, rows_per_file=MAX_ROWS_PER_FILE):
+        if xlwt is None:
+            raise RuntimeError('xlwt is required to generate agendas, install it with: pip install xlwt')
+
+        # group each session with its sub-sessions
+        groups = []
+        for row in self.iter_rows():
+            if row[3] == 'Sub' and groups:
+                groups[-1].append(row)
+            else:
+                groups.append([row])
+
+        files = [[]]
+        for group in groups:
+            if files[-1] and len(files[-1]) + len(group) > rows_per_file:
+                files.append([])
+            files[-1].extend(group)
+
+        if len(files) == 1:
+            paths = [path]
+        else:
+            base = path[:-4] if path.lower().endswith('.xls') else path
+            paths = [f'{base}_{n + 1}.xls' for n in range(len(files))]
+
+        for file_path, rows in zip(paths, files):
+            self.write_file(file_path, rows)
+        return paths
+
+    #
+    # Writes rows to a single .xls file, after the template rows and the header row
+    #
+    def write_file(self, path, rows):
+        book = xlwt.Workbook()
+        sheet = book.add_sheet('Agenda')
+        sheet.write(0, 0, 'Whova Agenda Excel Template')
+        sheet.write(1, 0, 'Generated agenda, see generate_agenda.py')
+        sheet.write(self.NUM_ROWS_TO_SKIP - 1, 0, 'START YOUR AGENDA BELOW')
+        for col, header in enumerate(self.HEADERS):
+            sheet.write(self.NUM_ROWS_TO_SKIP, col, header)
+
+        for row_num, row in enumerate(rows, self.NUM_ROWS_TO_SKIP + 1):
+            for col, value in enumerate(row):
+                sheet.write(row_num, col, value)
+        book.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(usage='./generate_agenda.py [options] <sessions> <.xls file path>')
+    parser.add_argument('sessions', type=int, help='total number of sessions and sub-sessions')
+    parser.add_argument('path')
+    parser.add_argument('--sub-sessions', type=int, default=2,
+                        help='number of sub-sessions of each session (default: 2)')
+    parser.add_argument('--speakers', type=int, default=2,
+                        help='number of speakers of each session (default: 2)')
+    parser.add_argument('--description-len', type=int, default=30,
+                        help='number of words of each description (default: 30)')
+    parser.add_argument('--speaker-pool', type=int, default=None,
+                        help='number of distinct speakers (default: a quarter of the sessions)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args()
+
+    generator = GenerateAgenda(args.sessions, args.sub_sessions, args.speakers, args.description_len,
+                               args.speaker_pool, args.seed)
+    try:
+        paths = generator.write(args.path)
+    except RuntimeError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+
+    for path in paths:
+        print(f'Wrote {path} ({os.path.getsize(path)} bytes)')
+
+if __name__ == '__main__':
+    main()
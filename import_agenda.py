@@ -1,14 +1,36 @@
 #!/usr/bin/env python3
+import os
 import sys
+import atexit
 import xlrd
-import sqlite3
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from db_table import db_table
+from agenda_snapshot import AgendaSnapshot
+from agenda_events import DEFAULT_EVENTS_DIR, event_db_path
+from agenda_time import session_interval
+from agenda_trigrams import trigrams
+from agenda_schema import SESSIONS_SCHEMA, SESSIONS_INDEXES, SESSIONS_FTS_SCHEMA, SPEAKERS_SCHEMA, \
+                          SPEAKERS_INDEXES, SESSION_SPEAKERS_SCHEMA, SESSION_SPEAKERS_INDEXES, \
+                          SPEAKER_TRIGRAMS_SCHEMA, SPEAKER_TRIGRAMS_INDEXES
 
 # 
-# Creates a 'sessions' and 'speakers' table and populates them with the data contained in the
-# provided .xls file. 
+# Creates a 'sessions' and 'speakers' table, linked by 'session_speakers', and populates them with
+# the data contained in the provided .xls file. The 'sessions_fts' full-text index of the sessions
+# and the 'speaker_trigrams' index of the speaker names are kept in sync with them.
 # 
-# Any new file passed through will completely override and delete existing data.
+# Any new file passed through will completely override and delete existing data, unless the
+# import is incremental, in which case only the differences with the existing data are applied.
+#
+# A full import is loaded into staging tables, which replace the live tables once the whole file
+# was read, and an incremental import applies its changes to the live tables, each in a single
+# transaction. The database is in WAL mode, so lookups keep being served the previous agenda during
+# the import, and a file failing to be parsed leaves it untouched.
+#
+# Several events can be hosted side by side, each in its own database (see agenda_events): an
+# import into an event never touches the other events.
 #
 class ImportAgenda:
 
@@ -18,53 +40,79 @@ class ImportAgenda:
 
     REQUIRED_FIELDS = {'date', 'time_start', 'time_end', 'session_or_sub-session(sub)', 'session_title'}
 
+    # Order of the headers in the tuples extracted for each row
+    ROW_HEADERS = ('date', 'time_start', 'time_end', 'session_or_sub-session(sub)',
+                   'session_title', 'room/location', 'description', 'speakers')
+
+    # Number of rows inserted at once while streaming a full import
+    BATCH_SIZE = 1000
+
     # Skip first 14 rows NUM_ROWS_TO_SKIP + 1 represents the first row of data
     NUM_ROWS_TO_SKIP = 14
 
+    # Columns of the 'sessions' table filled from the xls file
+    SESSION_FIELDS = ('date', 'time_start', 'time_end', 'session_title', 'location', 'description')
+
+    # (attribute, name, schema, indexes, module) of the agenda tables, see agenda_schema
+    TABLES = (('sessions', 'sessions', SESSIONS_SCHEMA, SESSIONS_INDEXES, None),
+              ('speakers', 'speakers', SPEAKERS_SCHEMA, SPEAKERS_INDEXES, None),
+              ('session_speakers', 'session_speakers', SESSION_SPEAKERS_SCHEMA, SESSION_SPEAKERS_INDEXES, None),
+              ('sessions_fts', 'sessions_fts', SESSIONS_FTS_SCHEMA, None, 'fts5'),
+              ('speaker_trigrams', 'speaker_trigrams', SPEAKER_TRIGRAMS_SCHEMA, SPEAKER_TRIGRAMS_INDEXES, None))
+
+    # Suffix of the staging tables a full import is loaded into
+    STAGING_SUFFIX = '_staging'
+
+    #
+    # Initializes 'sessions', 'speakers' and 'session_speakers' tables, creating them if they do
+    # not exist yet. Existing data is only replaced once a full import succeeds, see import_rows.
     #
-    # Initializes 'sessions' and 'speakers' tables.
-    # If these tables already exist, the tables are dropped and recreated to allow new
-    # data to take over.
+    # \param db_path      string   path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param incremental    boolean  whether to only apply the differences between the imported
+    #                                file and the existing data instead of replacing it, see sync_rows
+    # \param snapshot_path  string   if set, the compiled agenda snapshot (see AgendaSnapshot) is
+    #                                written there after every import
     #
-    def __init__(self):
+    def __init__(self, db_path=None, incremental=False, snapshot_path=None):
+        self.db_path = db_path
+        self.incremental = incremental
+        self.snapshot_path = snapshot_path
 
-        conn = sqlite3.connect(db_table.DB_NAME)
-        conn.execute("DROP TABLE IF EXISTS sessions")
-        conn.execute("DROP TABLE IF EXISTS speakers")
-        conn.commit()
-        conn.close()
-
-        # Create the table for sessions:
-        # Table will include information such as the PRIMARY KEY session id, another session id
-        # (if it is a sub-session), date of the session, starting and ending time of the session,
-        # name of the session, session location, and the description for the session.
-        # NOTE: Might be useful to add indexing to main_session_id to find sub-sessions of a
-        # session a lot faster. Same with date and location since these commonly correspond to
-        # larger amounts of data.
-        self.sessions = db_table('sessions', 
-                            {
-                                'id': 'integer PRIMARY KEY',
-                                'main_session_id': 'integer',
-                                'date': 'text',
-                                'time_start': 'text',
-                                'time_end': 'text',
-                                'session_title': 'text',
-                                'location': 'text',
-                                'description': 'text'
-                            })
-        
-        # Create the table for the speakers:
-        # Table will include information on the PRIMARY KEY speaker id, the session id that they
-        # are speaking at, and the name of the speaker.
-        # NOTE: 'id' is utilized for faster lookup and possible joins that might be needed later.
-        # NOTE: might go back and add an index for the speaker name and session_id for faster
-        # look up later.
-        self.speakers = db_table('speakers',
-                            {
-                                'id': 'integer PRIMARY KEY',
-                                'session_id': 'integer',
-                                'speaker_name': 'text'
-                            })
+        # The tables below share this same connection
+        conn = db_table.connect(db_path)
+
+        # Readers are not blocked by the import and keep reading the last committed agenda.
+        # The journal mode is persistent, so lookups opening the database later use it too.
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        # See agenda_schema for the tables description
+        self.open_tables()
+
+        # A database imported before the full-text or trigram index existed only gets it filled
+        # here, as an incremental import only writes the sessions and speakers that changed.
+        if incremental and self.sessions_fts.created:
+            with conn:
+                conn.execute("INSERT INTO sessions_fts (rowid, session_title, description) "
+                             "SELECT id, session_title, description FROM sessions")
+        if incremental and self.speaker_trigrams.created:
+            self.speaker_trigrams.insert_many(self.speaker_trigram_rows(self.speakers.iter_select()))
+            self.speaker_trigrams.create_indexes()
+        db_table.disconnect(db_path)
+
+    #
+    # Opens the agenda tables, creating them if needed, and closes the previously opened ones.
+    #
+    # \param suffix  string  suffix of the table names, e.g. STAGING_SUFFIX
+    #
+    def open_tables(self, suffix=''):
+        previous = [getattr(self, attr) for attr, *_ in self.TABLES if hasattr(self, attr)]
+        for attr, name, schema, indexes, module in self.TABLES:
+            setattr(self, attr, db_table(name + suffix, schema, indexes, self.db_path, module))
+
+        # closed after opening the new ones, so that the shared connection (and its ongoing
+        # transaction) stays open
+        for table in previous:
+            table.close()
 
     #
     # Database import and initialization.
@@ -74,46 +122,363 @@ class ImportAgenda:
     # \param file_path  string  path to the .xls file to be imported.
     #
     def import_file(self, file_path):
-        rows = self.extract_xls(file_path)
-        
+        # Rows are streamed from the file straight into the database
+        self.import_rows(self.iter_xls(file_path), file_path)
+
+    #
+    # Imports several .xls files, previously extracted by extract_files, as a single agenda as if
+    # they were concatenated in the given order. The files are parsed and validated in parallel
+    # by a pool of processes while this process remains the only one writing to the database,
+    # as SQLite only allows a single writer.
+    #
+    # Nothing is written if any of the files failed to be extracted, or if a row of a file
+    # duplicates a row of a previous file (duplicates within a file are rejected by extract_xls).
+    #
+    # \param extracted  list  (file path, rows, error) tuples returned by extract_files
+    #
+    # \error RuntimeError is thrown if any file failed to be extracted, listing the error of
+    #                     each failed file, or if a row is a duplicate of a previous one
+    #
+    def import_extracted(self, extracted):
+        errors = [f'{path}: {error}' for path, _, error in extracted if error]
+        if errors:
+            raise RuntimeError('Failed to extract ' + '; '.join(errors))
+
+        # extracted rows are numbered as read_rows does, no row being skipped by the extraction
+        digests = set()
+        rows = itertools.chain.from_iterable(
+            (data_row for _, data_row in
+             self.reject_duplicates(enumerate(rows, self.NUM_ROWS_TO_SKIP + 1), digests, path))
+            for path, rows, _ in extracted)
+        self.import_rows(rows, f'{len(extracted)} files')
+
+    #
+    # Writes the given rows to the database, replacing the existing agenda or synchronizing it
+    # if the import is incremental, then builds the indexes.
+    #
+    # \param rows    iterable  rows extracted by extract_xls / iter_xls
+    # \param source  string    description of where the rows come from, for reporting
+    #
+    def import_rows(self, rows, source):
+        # Either import runs in a single transaction, along with the generation bump letting the
+        # lookups know that the data changed, so that a failure at any point leaves nothing behind
+        # and readers never see (nor cache) a partly imported agenda. IMMEDIATE takes the write
+        # lock up front, readers are not blocked (WAL) and keep reading the previous agenda.
+        conn = self.sessions.db_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.incremental:
+                count, inserted, updated, deleted = self.sync_rows(rows)
+                self.create_indexes()
+            else:
+                # the staging tables are created, loaded and swapped in within the transaction
+                for _, name, *_ in self.TABLES:
+                    conn.execute("DROP TABLE IF EXISTS %s%s" % (name, self.STAGING_SUFFIX))
+                self.open_tables(self.STAGING_SUFFIX)
+                count = self.load_rows(rows)
+                self.swap_tables()
+            self.sessions.bump_generation(commit=False)
+            self.remove_snapshots()
+        except BaseException:
+            conn.rollback()
+            self.open_tables()
+            raise
+        conn.commit()
+
+        if self.incremental:
+            print(f'Successfully synchronized {count} rows from {source}: '
+                  f'{inserted} inserted, {updated} updated, {deleted} deleted')
+        else:
+            print(f'Successfully imported {count} rows from {source}')
+        self.write_snapshot()
+
+    #
+    # Compiles the agenda snapshot of the imported database, if requested, see __init__
+    #
+    def write_snapshot(self):
+        if self.snapshot_path:
+            AgendaSnapshot.build(self.db_path, self.snapshot_path)
+
+    #
+    # Removes the snapshots of the database, before the import commits.
+    # A snapshot is only checked against the database generation, which restarts when the database
+    # is deleted and imported again, so a snapshot left from the previous database could have the
+    # same generation as the new one and be served in its place if no new snapshot gets written
+    # (--no-snapshot, or a failure to write it). Lookups rebuild a missing snapshot on demand.
+    #
+    def remove_snapshots(self):
+        for path in {AgendaSnapshot.default_path(self.db_path), self.snapshot_path}:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    #
+    # Replaces the live tables with the loaded staging tables, then builds their indexes.
+    # Indexes are built once the staging tables are renamed, so that they get the names of the
+    # live indexes (dropped along with the live tables).
+    # Meant to run inside the transaction of the import, see import_rows.
+    #
+    def swap_tables(self):
+        conn = self.sessions.db_conn
+        for _, name, *_ in self.TABLES:
+            conn.execute("DROP TABLE IF EXISTS %s" % name)
+            conn.execute("ALTER TABLE %s%s RENAME TO %s" % (name, self.STAGING_SUFFIX, name))
+
+        self.open_tables()
+        self.create_indexes()
+
+    #
+    # Builds the indexes of the agenda tables.
+    # Building the indexes after the bulk load is cheaper than updating them on every insert.
+    #
+    def create_indexes(self):
+        self.sessions.create_indexes()
+        self.speakers.create_indexes()
+        self.session_speakers.create_indexes()
+        self.speaker_trigrams.create_indexes()
+
+    #
+    # Inserts the given rows into the (empty) tables.
+    # Rows are consumed and inserted BATCH_SIZE at a time, so the whole file never needs to be
+    # held in memory. Nothing is committed: the batches are part of the transaction of the
+    # import, committed by import_rows once every row was read, so that an invalid row leaves
+    # nothing behind.
+    #
+    # \param rows  iterable  rows extracted by extract_xls / iter_xls
+    #
+    # \return number of imported rows
+    #
+    def load_rows(self, rows):
+        count = 0
+
+        # If current row is a sub-session, utilize this to find main session id
+        sub_to_main = None
+        self.load_speaker_ids()
+        for batch in iter(lambda: list(itertools.islice(rows, self.BATCH_SIZE)), []):
+            # Session ids are reserved up front so that sub-sessions can be linked to their main
+            # session before anything is written, allowing both tables to be bulk inserted.
+            session_ids = self.sessions.next_ids(len(batch))
+            sessions = []
+            speakers = []
+            links = []
+            texts = []
+
+            for sid, row in zip(session_ids, batch):
+                is_sub, fields, speaker_names = self.parse_row(row)
+                if is_sub:
+                    main_session_id = sub_to_main
+                else:
+                    main_session_id = None
+                    sub_to_main = sid
+
+                sessions.append(dict(fields, id=sid, main_session_id=main_session_id))
+                self.link_speakers(sid, speaker_names, speakers, links)
+                texts.append(self.session_text(sid, fields))
+
+            # Values are bound as parameters by insert_many, so no manual quote escaping is needed.
+            self.sessions.insert_many(sessions, 'id', commit=False)
+            self.speakers.insert_many(speakers, commit=False)
+            self.session_speakers.insert_many(links, commit=False)
+            self.speaker_trigrams.insert_many(self.speaker_trigram_rows(speakers), commit=False)
+            self.sessions_fts.insert_many(texts, commit=False)
+            count += len(batch)
+
+        return count
+
+    #
+    # Incremental import.
+    # Compares the given rows with the sessions and speakers already in the database and only
+    # applies the inserts, updates and deletes needed to reach the new state.
+    #
+    # Rows are matched to existing sessions through a key made of their main session id, date,
+    # start time and title. Since rows are processed in order, the main session of a sub-session
+    # is always matched (or inserted) first, so its key refers to the up to date main session id.
+    # A matched session is only updated if any of its fields or speakers changed, sessions that
+    # are no longer in the file are deleted along with their speaker links, and speakers left
+    # without any session are deleted.
+    # Nothing is committed, the caller runs the sync in a transaction, see import_rows.
+    #
+    # \param rows  iterable  rows extracted by extract_xls / iter_xls
+    #
+    # \return (number of rows, number of inserted sessions, number of updated sessions,
+    #          number of deleted sessions)
+    #
+    def sync_rows(self, rows):
+        # case-folded speaker names of each session, in link order
+        speakers_by_session = {}
+        query = ("SELECT session_speakers.session_id, speakers.name_key FROM session_speakers"
+                 " JOIN speakers ON speakers.id = session_speakers.speaker_id"
+                 " ORDER BY session_speakers.rowid")
+        for session_id, name_key in self.session_speakers.iter_query(query, row_mode='tuple'):
+            speakers_by_session.setdefault(session_id, []).append(name_key)
+        self.load_speaker_ids()
+
+        # key -> [(session id, content)] of the existing sessions, in id order
+        existing = {}
+        for session in self.sessions.iter_select():
+            fields = {field: session[field] for field in self.SESSION_FIELDS}
+            key = self.session_key(session['main_session_id'], fields)
+            content = self.session_content(fields, speakers_by_session.get(session['id'], []))
+            existing.setdefault(key, []).append((session['id'], content))
+
+        next_id = self.sessions.next_ids(1)[0]
+        inserts, updates, replaced_speakers, speakers, links = [], [], [], [], []
+        text_inserts, text_updates = [], []
+
         # If current row is a sub-session, utilize this to find main session id
         sub_to_main = None
+        count = 0
         for row in rows:
-            date, time_start, time_end, sesh_type, sesh_title, loc, desc, speaker = row
-            sid = None
-            if sesh_type.lower() == 'sub':
-                sid = self.sessions.insert({
-                    'main_session_id': sub_to_main,
-                    'date': date.replace("'", "''").strip(),
-                    'time_start': time_start.replace("'", "''").strip(),
-                    'time_end': time_end.replace("'", "''").strip(),
-                    'session_title': sesh_title.replace("'", "''").strip(),
-                    'location': loc.replace("'", "''").strip(),
-                    'description': desc.replace("'", "''").strip()
-                })
+            count += 1
+            is_sub, fields, speaker_names = self.parse_row(row)
+            main_session_id = sub_to_main if is_sub else None
+
+            matches = existing.get(self.session_key(main_session_id, fields))
+            if matches:
+                sid, content = matches.pop(0)
+                if content != self.session_content(fields, speaker_names):
+                    updates.append(dict(fields, id=sid))
+                    text_updates.append(self.session_text(sid, fields))
+                    replaced_speakers.append(sid)
+                    self.link_speakers(sid, speaker_names, speakers, links)
             else:
-                sid = self.sessions.insert({
-                    'main_session_id': None,
-                    'date': date.replace("'", "''").strip(),
-                    'time_start': time_start.replace("'", "''").strip(),
-                    'time_end': time_end.replace("'", "''").strip(),
-                    'session_title': sesh_title.replace("'", "''").strip(),
-                    'location': loc.replace("'", "''").strip(),
-                    'description': desc.replace("'", "''").strip()
-                })
+                sid = next_id
+                next_id += 1
+                inserts.append(dict(fields, id=sid, main_session_id=main_session_id))
+                text_inserts.append(self.session_text(sid, fields))
+                self.link_speakers(sid, speaker_names, speakers, links)
+
+            if not is_sub:
                 sub_to_main = sid
-            
-            if speaker:
-                for person in speaker.split(';'):
-                    person = person.strip()
-                    if not person:
-                        continue
-                    self.speakers.insert({
-                        'session_id': sid,
-                        'speaker_name': person.replace("'", "''")
-                    })
-        
-        print(f'Successfully imported {len(rows)} rows from {file_path}')
+
+        # Existing sessions left unmatched are no longer part of the agenda
+        deletes = [sid for matches in existing.values() for sid, _ in matches]
+
+        self.sessions.delete_many('id', deletes, commit=False)
+        self.session_speakers.delete_many('session_id', deletes + replaced_speakers, commit=False)
+        self.sessions.update_many(updates, commit=False)
+        self.sessions.insert_many(inserts, 'id', commit=False)
+        self.speakers.insert_many(speakers, commit=False)
+        self.session_speakers.insert_many(links, commit=False)
+        self.speaker_trigrams.insert_many(self.speaker_trigram_rows(speakers), commit=False)
+        query = "SELECT id FROM speakers WHERE id NOT IN (SELECT speaker_id FROM session_speakers)"
+        orphans = [speaker_id for speaker_id, in self.speakers.iter_query(query, row_mode='tuple')]
+        self.speakers.delete_many('id', orphans, commit=False)
+        self.speaker_trigrams.delete_many('speaker_id', orphans, commit=False)
+        self.sessions_fts.delete_many('rowid', deletes, commit=False)
+        self.sessions_fts.update_many(text_updates, 'rowid', commit=False)
+        self.sessions_fts.insert_many(text_inserts, commit=False)
+
+        return count, len(inserts), len(updates), len(deletes)
+
+    #
+    # Splits a row extracted by extract_xls into the values stored in the database.
+    #
+    # \param row  tuple  row extracted by extract_xls
+    #
+    # \return (whether the row is a sub-session, dict of the SESSION_FIELDS values and of the
+    #          normalized starts_at / ends_at timestamps, list of the speaker names without
+    #          case-insensitive duplicates)
+    #
+    @classmethod
+    def parse_row(cls, row):
+        date, time_start, time_end, sesh_type, sesh_title, loc, desc, speaker = row
+        fields = {
+            'date': date.strip(),
+            'time_start': time_start.strip(),
+            'time_end': time_end.strip(),
+            'session_title': sesh_title.strip(),
+            'location': loc.strip(),
+            'description': desc.strip()
+        }
+        fields['starts_at'], fields['ends_at'] = session_interval(fields['date'], fields['time_start'],
+                                                                  fields['time_end'])
+
+        speaker_names = []
+        speaker_keys = set()
+        if speaker:
+            for person in speaker.split(';'):
+                person = person.strip()
+                if person and cls.speaker_key(person) not in speaker_keys:
+                    speaker_keys.add(cls.speaker_key(person))
+                    speaker_names.append(person)
+
+        return sesh_type.lower() == 'sub', fields, speaker_names
+
+    #
+    # Key identifying a session across imports, see sync_rows.
+    #
+    @staticmethod
+    def session_key(main_session_id, fields):
+        return main_session_id, fields['date'], fields['time_start'], fields['session_title']
+
+    #
+    # Row of the 'sessions_fts' full-text index for a session.
+    #
+    @staticmethod
+    def session_text(session_id, fields):
+        return {'rowid': session_id, 'session_title': fields['session_title'],
+                'description': fields['description']}
+
+    #
+    # Full content of a session, used to detect the sessions that changed between imports.
+    #
+    # Speakers are compared by their case-folded names, as the name stored for a speaker is the
+    # first spelling seen for it.
+    #
+    @classmethod
+    def session_content(cls, fields, speaker_names):
+        return tuple(fields[field] for field in cls.SESSION_FIELDS) + \
+               tuple(cls.speaker_key(name) for name in speaker_names)
+
+    #
+    # Case-folded name identifying a speaker, see the 'speakers' table.
+    #
+    @staticmethod
+    def speaker_key(name):
+        return name.lower()
+
+    #
+    # Loads the name to id map of the speakers already in the database, which link_speakers
+    # completes with the new speakers.
+    #
+    def load_speaker_ids(self):
+        self.speaker_ids = dict(self.speakers.iter_select(['name_key', 'id'], row_mode='tuple'))
+        self.next_speaker_id = self.speakers.next_ids(1)[0]
+
+    #
+    # Rows of the 'speaker_trigrams' index for the given speakers, see agenda_trigrams.
+    #
+    # \param speakers  iterable  'speakers' rows
+    #
+    # \return List of { 'trigram': ..., 'speaker_id': ..., 'trigram_count': ... }
+    #
+    @staticmethod
+    def speaker_trigram_rows(speakers):
+        rows = []
+        for speaker in speakers:
+            grams = trigrams(speaker['name_key'])
+            rows.extend({'trigram': gram, 'speaker_id': speaker['id'], 'trigram_count': len(grams)}
+                        for gram in sorted(grams))
+        return rows
+
+    #
+    # Links a session to its speakers, registering the speakers seen for the first time.
+    # Requires load_speaker_ids to have been called.
+    #
+    # \param session_id     integer  id of the session
+    # \param speaker_names  list     names of its speakers, as returned by parse_row
+    # \param speakers       list     receives the 'speakers' rows of the new speakers
+    # \param links          list     receives the 'session_speakers' rows of the session
+    #
+    def link_speakers(self, session_id, speaker_names, speakers, links):
+        for name in speaker_names:
+            key = self.speaker_key(name)
+            speaker_id = self.speaker_ids.get(key)
+            if speaker_id is None:
+                speaker_id = self.speaker_ids[key] = self.next_speaker_id
+                self.next_speaker_id += 1
+                speakers.append({'id': speaker_id, 'speaker_name': name, 'name_key': key})
+            links.append({'session_id': session_id, 'speaker_id': speaker_id})
 
     @classmethod
     #
@@ -135,10 +500,81 @@ class ImportAgenda:
     #                     there is a row.
     #
     def extract_xls(cls, file_path):
-        book = xlrd.open_workbook(file_path)
-        sh = book.sheet_by_index(0)
+        return list(cls.iter_xls(file_path))
+
+    @classmethod
+    #
+    # Extracts several .xls files in parallel, each one in its own process.
+    # An error in one file does not prevent the other files from being extracted.
+    #
+    # \param file_paths  list     paths to the .xls files to be extracted.
+    # \param jobs        integer  number of processes. defaults to the number of CPUs
+    #
+    # \return List of (file path, extracted rows or None, error or None), in the given order
+    #
+    def extract_files(cls, file_paths, jobs=None):
+        jobs = min(jobs or os.cpu_count() or 1, len(file_paths))
+        if jobs <= 1:
+            return [cls.try_extract_xls(path) for path in file_paths]
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(cls.try_extract_xls, file_paths))
+
+    @classmethod
+    #
+    # Same as extract_xls, but returns the error instead of raising it so that a failed file
+    # can be reported along with the others.
+    #
+    # \param file_path  string  path to the .xls file to be extracted.
+    #
+    # \return (file path, extracted rows or None, error message or None)
+    #
+    def try_extract_xls(cls, file_path):
+        try:
+            return file_path, cls.extract_xls(file_path), None
+        except Exception as e:
+            return file_path, None, f'{type(e).__name__}: {e}'
+
+    @classmethod
+    #
+    # Streaming variant of extract_xls, yielding the rows one at a time as they are read and
+    # validated, so that they can be inserted while the rest of the file is still being parsed.
+    # The extraction is a pipeline of generator stages: read_rows -> check_required_fields ->
+    # reject_duplicates.
+    #
+    # Note that errors (missing headers or fields, duplicate rows) are raised while iterating,
+    # possibly after some rows were already yielded.
+    #
+    # \param file_path  string  path to the .xls file to be imported.
+    #
+    # \return generator of the tuples containing the data per row, see extract_xls
+    #
+    def iter_xls(cls, file_path):
+        # on_demand only loads the sheets that are actually accessed
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            sh = book.sheet_by_index(0)
+            rows = cls.read_rows(sh, cls.read_headers(sh))
+            rows = cls.check_required_fields(rows)
+            rows = cls.reject_duplicates(rows)
+            for _, data_row in rows:
+                yield data_row
+        finally:
+            book.release_resources()
+
+    @classmethod
+    #
+    # Reads and normalizes the headers of the sheet.
+    #
+    # \param sh  xlrd.sheet.Sheet  agenda sheet
+    #
+    # \return dict mapping each normalized header to its column index
+    #
+    # \error RuntimeError is thrown if an expected header is missing
+    #
+    def read_headers(cls, sh):
         columns = []
-        
+
         # Extract all the headers and replace spaces with underscore,
         # remove trailing whitespace, and remove * char.
         for header in range(sh.ncols):
@@ -156,43 +592,71 @@ class ImportAgenda:
             print("Received more columns than expected.")
             print(f"Expected {len(cls.EXPECTED_HEADERS)} columns, received {len(columns)} columns.")
             print("Processing with import, ignoring extra columns.")
-        
-        # Iterate over all the rows and extract data as tuples into rows. 
-        # Also check for any duplicate rows and raise error if so.
-        index = {h: i for i, h in enumerate(columns)}
-        rows = []
-        duplicate_rows = set()
+
+        return {h: i for i, h in enumerate(columns)}
+
+    @classmethod
+    #
+    # Pipeline stage reading the data rows of the sheet, one at a time.
+    #
+    # \param sh     xlrd.sheet.Sheet  agenda sheet
+    # \param index  dict              column index of each header, see read_headers
+    #
+    # \return generator of (row number, data tuple ordered as ROW_HEADERS)
+    #
+    def read_rows(cls, sh, index):
+        positions = [index[h] for h in cls.ROW_HEADERS]
         for row_num in range(cls.NUM_ROWS_TO_SKIP + 1, sh.nrows):
             row = sh.row(row_num)
+            yield row_num, tuple(row[i].value for i in positions)
 
-            # Ensures that Session Title, Date, Time Start, Time End, Session are provided
-            vals = {h: row[index[h]].value for h in cls.REQUIRED_FIELDS}
-            missing = [h for h, v in vals.items() if not str(v).strip()]
+    @classmethod
+    #
+    # Pipeline stage ensuring that Session Title, Date, Time Start, Time End, Session are provided.
+    #
+    # \param rows  generator  (row number, data tuple) pairs
+    #
+    # \return generator of the same pairs
+    #
+    # \error RuntimeError is thrown if a row is missing a required field
+    #
+    def check_required_fields(cls, rows):
+        required = {h: cls.ROW_HEADERS.index(h) for h in cls.REQUIRED_FIELDS}
+        for row_num, data_row in rows:
+            missing = [h for h, i in required.items() if not str(data_row[i]).strip()]
             if missing:
                 missing = [norm.replace('_', ' ') for norm in missing]
                 raise RuntimeError(
                     f"Missing required fields: {', '.join(missing)} in row {row_num+1}"
                 )
+            yield row_num, data_row
 
-            data_row = (
-                row[index['date']].value,
-                row[index['time_start']].value,
-                row[index['time_end']].value,
-                row[index['session_or_sub-session(sub)']].value,
-                row[index['session_title']].value,
-                row[index['room/location']].value,
-                row[index['description']].value,
-                row[index['speakers']].value,
-            )
-
-            if data_row in duplicate_rows:
+    @classmethod
+    #
+    # Pipeline stage rejecting duplicate rows.
+    # Only a 16 bytes digest of each row is remembered rather than the whole row.
+    #
+    # \param rows       generator  (row number, data tuple) pairs
+    # \param digests    set        digests of the rows already seen, shared to reject duplicates
+    #                              across several files. defaults to a new set
+    # \param file_path  string     file the rows come from, mentioned in the error if given
+    #
+    # \return generator of the same pairs
+    #
+    # \error RuntimeError is thrown if a row is a duplicate of a previous one
+    #
+    def reject_duplicates(cls, rows, digests=None, file_path=None):
+        digests = set() if digests is None else digests
+        for row_num, data_row in rows:
+            digest = hashlib.blake2b('\x1f'.join(str(v) for v in data_row).encode(),
+                                     digest_size=16).digest()
+            if digest in digests:
+                where = f"row {row_num}" if file_path is None else f"{file_path}, row {row_num}"
                 raise RuntimeError(
-                    f"Duplicate agenda in row {row_num}: {', '.join(data_row)}"
+                    f"Duplicate agenda in {where}: {', '.join(data_row)}"
                 )
-            duplicate_rows.add(data_row)
-            rows.append(data_row)
-        
-        return rows
+            digests.add(digest)
+            yield row_num, data_row
 
     #
     # Close the database connection
@@ -200,16 +664,99 @@ class ImportAgenda:
     def close_conn(self):
         self.sessions.close()
         self.speakers.close()
-        
+        self.session_speakers.close()
+        self.sessions_fts.close()
+        self.speaker_trigrams.close()
+
+
+#
+# Expands the paths given on the command line, replacing each directory with the .xls files it
+# contains (in name order).
+#
+# \param paths  list  file and directory paths
+#
+# \return List of .xls file paths
+#
+def expand_paths(paths):
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                     if name.lower().endswith('.xls')))
+        else:
+            file_paths.append(path)
+    return file_paths
+
 
 def main():
-    if len(sys.argv) != 2:
-        print('Usage: ./import_agenda.py <.xls file path>')
+    parser = argparse.ArgumentParser(usage='./import_agenda.py [--db <database path> | --event <name>] [--incremental] '
+                                           '[--jobs <count>] [--no-snapshot] [--stats] [--slow-ms <ms>]\n'
+                                           '                        <.xls file or directory path>...')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--db', dest='db_path', default=None,
+                        help=f'SQLite database to import into (default: {db_table.DB_NAME})')
+    parser.add_argument('--event', default=None,
+                        help='import into the database of the named event, leaving the other events untouched')
+    parser.add_argument('--events-dir', default=None,
+                        help=f'directory holding the event databases (default: {DEFAULT_EVENTS_DIR})')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only apply the differences with the already imported agenda')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='do not write the compiled agenda snapshot used by lookup_agenda.py --snapshot')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='number of processes parsing the files (default: number of CPUs)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print statistics of the SQL statements run, at exit')
+    parser.add_argument('--slow-ms', type=float, default=None, metavar='MS',
+                        help='log the SQL statements taking at least MS milliseconds, with their query '
+                             'plan (implies --stats)')
+    args = parser.parse_args()
+
+    if args.event:
+        if args.db_path:
+            parser.error('--db and --event cannot be used together')
+        try:
+            args.db_path = event_db_path(args.event, args.events_dir)
+        except ValueError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        os.makedirs(os.path.dirname(args.db_path), exist_ok=True)
+
+    if args.stats or args.slow_ms is not None:
+        atexit.register(db_table.instrument(args.slow_ms).print_summary)
+
+    snapshot_path = None if args.no_snapshot else AgendaSnapshot.default_path(args.db_path)
+    file_paths = expand_paths(args.paths)
+    if not file_paths:
+        print('Error: no .xls file to import')
         sys.exit(1)
 
-    imported_agenda = ImportAgenda()
-    imported_agenda.import_file(sys.argv[1])
-    imported_agenda.close_conn()
+    if len(file_paths) == 1:
+        imported_agenda = ImportAgenda(args.db_path, args.incremental, snapshot_path)
+        imported_agenda.import_file(file_paths[0])
+        imported_agenda.close_conn()
+        return
+
+    # Files are parsed before the database is touched, so that every bad file gets reported and
+    # the write transaction is not held while parsing.
+    extracted = ImportAgenda.extract_files(file_paths, args.jobs)
+    errors = [(path, error) for path, _, error in extracted if error]
+    for path, error in errors:
+        print(f'Error in {path}: {error}')
+    if errors:
+        print(f'{len(errors)} of {len(file_paths)} files failed, nothing was imported.')
+        sys.exit(1)
+
+    imported_agenda = ImportAgenda(args.db_path, args.incremental, snapshot_path)
+    try:
+        imported_agenda.import_extracted(extracted)
+    except RuntimeError as e:
+        # a row duplicating a row of a previous file, found while importing
+        print(f'Error: {e}')
+        print('Nothing was imported.')
+        sys.exit(1)
+    finally:
+        imported_agenda.close_conn()
 
 if __name__ == '__main__':
     main()
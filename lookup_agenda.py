@@ -1,6 +1,22 @@
 #!/usr/bin/env python3
+import os
 import sys
+import atexit
+import json
+import sqlite3
+import argparse
+from collections import OrderedDict
 from db_table import db_table
+from datetime import datetime, timedelta
+from agenda_index import AgendaIndex
+from agenda_snapshot import AgendaSnapshot
+from agenda_events import DEFAULT_EVENTS_DIR, event_db_path
+from agenda_query import parse_query, compile_query
+from agenda_trigrams import SIMILARITY_THRESHOLD, trigrams, prefix_trigrams, is_word_prefix
+from agenda_time import MAX_DURATION, parse_timestamp, format_timestamp
+from agenda_schema import SESSIONS_SCHEMA, SESSIONS_INDEXES, SESSIONS_FTS_SCHEMA, SPEAKERS_SCHEMA, \
+                          SPEAKERS_INDEXES, SESSION_SPEAKERS_SCHEMA, SESSION_SPEAKERS_INDEXES, \
+                          SPEAKER_TRIGRAMS_SCHEMA, SPEAKER_TRIGRAMS_INDEXES
 
 #
 # Allows the user to search for specific values in their agenda database.
@@ -8,70 +24,155 @@ from db_table import db_table
 # in their agenda with that date will be displayed.
 # 
 # If the user prompts to search by speaker, only one speaker's name can be taken at a time.
+# Speakers whose exact name is not known can be found by approximate name or by the beginning of
+# their name, see match_speakers.
+#
+# Session titles and descriptions can also be searched by words through the full-text index,
+# see lookup_text, and the sessions can be looked up by time range through their normalized
+# timestamps, see lookup_running / lookup_overlapping / lookup_double_bookings.
+#
+# Several column lookups can be combined into a single query with AND / OR / IN, see
+# lookup_query and agenda_query.
 #
 class LookupAgenda:
 
     # Set of columns that the user can lookup by.
     VALID_COLS = {'date', 'time_start', 'time_end', 'session_title', 'location', 'description', 'speaker'}
 
+    # Pseudo column used to run a full-text search with lookup / iter_lookup
+    TEXT_SEARCH = 'search'
+
+    # Pseudo column used to run a compound query with lookup / iter_lookup, see agenda_query
+    QUERY = 'query'
+
+    # Maximum number of speakers returned by match_speakers
+    DEFAULT_MATCHES = 10
+
+    #
+    # Initializes the sessions and speakers table, and the sessions full-text index, in order to
+    # be searched in later methods. All tables share a single connection to the database.
     #
-    # Initializes the sessions and speakers table in order to be searched in later methods.
-    #
-    def __init__(self):
-        
-        # Create the table for sessions:
-        # Table will include information such as the PRIMARY KEY session id, another session id
-        # (if it is a sub-session), date of the session, starting and ending time of the session,
-        # name of the session, session location, and the description for the session.
-        # NOTE: Might be useful to add indexing to main_session_id to find sub-sessions of a
-        # session a lot faster. Same with date and location since these commonly correspond to
-        # larger amounts of data.
-        self.sessions = db_table('sessions', 
-                            {
-                                'id': 'integer PRIMARY KEY',
-                                'main_session_id': 'integer',
-                                'date': 'text',
-                                'time_start': 'text',
-                                'time_end': 'text',
-                                'session_title': 'text',
-                                'location': 'text',
-                                'description': 'text'
-                            })
-        
-        # Create the table for the speakers:
-        # Table will include information on the PRIMARY KEY speaker id, the session id that they
-        # are speaking at, and the name of the speaker.
-        # NOTE: 'id' is utilized for faster lookup and possible joins that might be needed later.
-        # NOTE: might go back and add an index for the speaker name and session_id for faster
-        # look up later.
-        self.speakers = db_table('speakers',
-                            {
-                                'id': 'integer PRIMARY KEY',
-                                'session_id': 'integer',
-                                'speaker_name': 'text'
-                            })
-    
+    # \param db_path    string   path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param in_memory   boolean  whether to load the agenda into an in-memory AgendaIndex and
+    #                             answer the column and speaker lookups from it instead of SQLite
+    # \param cache_size  integer  number of lookup results kept in an LRU cache, 0 to disable it.
+    #                             the cache (and the in-memory index) are dropped whenever the
+    #                             importer bumps the database generation
+    # \param read_only   boolean  whether to open the database read only, see db_table.connect. the
+    #                             agenda must then already be imported
+    #
+    def __init__(self, db_path=None, in_memory=False, cache_size=0, read_only=False):
+
+        # See agenda_schema for the tables description. Indexes are built by the importer.
+        self.sessions = db_table('sessions', SESSIONS_SCHEMA, SESSIONS_INDEXES, db_path, read_only=read_only)
+        self.speakers = db_table('speakers', SPEAKERS_SCHEMA, SPEAKERS_INDEXES, db_path, read_only=read_only)
+        self.session_speakers = db_table('session_speakers', SESSION_SPEAKERS_SCHEMA,
+                                         SESSION_SPEAKERS_INDEXES, db_path, read_only=read_only)
+        self.sessions_fts = db_table('sessions_fts', SESSIONS_FTS_SCHEMA, db_path=db_path, module='fts5',
+                                     read_only=read_only)
+        self.speaker_trigrams = db_table('speaker_trigrams', SPEAKER_TRIGRAMS_SCHEMA, SPEAKER_TRIGRAMS_INDEXES,
+                                         db_path, read_only=read_only)
+        self.cache = LookupCache(cache_size) if cache_size else None
+        if in_memory:
+            self.generation, self.index = self.load_index()
+        else:
+            self.generation, self.index = self.sessions.generation(), None
+
     #
     # Searches the appropriate tables for a specific column and value.
     # Gathers the date, time start, time end, session title, location, and description for the
     # column and value and displays it in a viewable manner.
+    # Sessions are printed as they are read from the database, without waiting for the whole
+    # result.
     #
     # \param column  string  the column that the user wishes to search by
     # \param value   string  the value that the user wishes to search by within the column
     #
+    # \return number of matching sessions
+    #
     def lookup(self, column, value):
-        if column == 'speaker':
-            res = self.lookup_speaker(value)
-        else:
-            res = self.lookup_column(column, value)
-        
-        for out in res:
-            print(f"Date: {out['date']}\t Time start: {out['time_start']}\t Time End: {out['time_end']}")
-            print(f"Session Title: {out['session_title']}\t Location: {out['location']}")
-            print('Description:\n', out['description'])
-            print('='*80, '\n')
+        sessions = self.iter_lookup(column, value, row_mode='row')
+        try:
+            return print_sessions(sessions)
+        finally:
+            # release the cursor of an abandoned stream while the connection is still open
+            close = getattr(sessions, 'close', None)
+            if close is not None:
+                close()
 
-        print(f"\nTotal matching sessions: {len(res)}")
+    #
+    # Streaming variant of lookup_column / lookup_speaker / lookup_text / lookup_query, yielding
+    # the matching sessions as they are read from the database.
+    #
+    # \param column    string  the column that the user wishes to search by, 'speaker',
+    #                          TEXT_SEARCH or QUERY
+    # \param value     string  the value that the user wishes to search by within the column
+    # \param row_mode  string  format of the yielded rows, see db_table.ROW_MODES
+    #
+    # \return generator of the matching sessions
+    #
+    # \error ValueError is thrown if a compound query is malformed, see agenda_query.parse_query
+    #
+    def iter_lookup(self, column, value, row_mode='dict'):
+        if self.cache is None and self.index is None:
+            return self.iter_lookup_uncached(column, value, row_mode)
+
+        self.check_generation()
+        if self.cache is None or row_mode == 'tuple':
+            return self.iter_lookup_uncached(column, value, row_mode)
+
+        key = (column, value if column == self.TEXT_SEARCH else value.lower())
+        sessions = self.cache.get(key)
+        if sessions is None:
+            sessions = list(self.iter_lookup_uncached(column, value))
+            self.cache.put(key, sessions)
+        return iter(sessions)
+
+    #
+    # iter_lookup, bypassing the result cache
+    #
+    def iter_lookup_uncached(self, column, value, row_mode='dict'):
+        if column == self.QUERY:
+            return self.iter_expand_sessions(*self.compound_query(value), row_mode)
+        if self.index and column != self.TEXT_SEARCH:
+            return iter(self.index.lookup(column, value, 'tuple' if row_mode == 'tuple' else 'dict'))
+
+        # full-text queries are case-insensitive already, and their operators must stay uppercase
+        param = value if column == self.TEXT_SEARCH else value.lower()
+        return self.iter_expand_sessions(self.seed_query(column), [param], row_mode)
+
+    #
+    # Drops the cached results and reloads the in-memory index if the database was re-imported
+    # since they were built. Costs a single PRAGMA read, no table is read unless the data changed.
+    #
+    def check_generation(self):
+        generation = self.sessions.generation()
+        if generation == self.generation:
+            return
+
+        if self.index is not None:
+            generation, self.index = self.load_index()
+        self.generation = generation
+        if self.cache is not None:
+            self.cache.clear()
+
+    #
+    # Loads the agenda into an AgendaIndex.
+    # The database is read in a single read transaction, as in AgendaSnapshot.build, so that an
+    # import committing meanwhile cannot leave the index with the sessions of one generation and
+    # the speakers of another.
+    #
+    # \return (generation the index was loaded from, AgendaIndex)
+    #
+    def load_index(self):
+        conn = self.sessions.db_conn
+        conn.execute('BEGIN')
+        try:
+            generation = self.sessions.generation()
+            index = AgendaIndex(self.sessions, self.speakers)
+        finally:
+            conn.rollback()
+        return generation, index
 
     #
     # Searches through the database for a specified column that is not a 'speaker'.
@@ -86,15 +187,7 @@ class LookupAgenda:
     # will contain all sessions where their date is '06/16/2018'.
     #
     def lookup_column(self, column, value):
-        out = []
-        duplicate = set()
-        
-        found_ids = self.sessions.select(columns=['id'], where={f"lower({column})": value.lower()})
-        for row in found_ids:
-            session_id = row['id']
-            self.grab_rows(out, duplicate, session_id)
-        
-        return out
+        return list(self.iter_lookup(column, value))
 
     #
     # Searches through the database for a specific speaker's name and gathers all the
@@ -105,50 +198,363 @@ class LookupAgenda:
     # \return List of all the sessions the speaker is speaking at
     #
     def lookup_speaker(self, speaker_name):
-        out = []
-        duplicate = set()
-
-        found_ids = self.sessions.select_join(
-            other_db='speakers',
-            left='id',
-            right='session_id',
-            columns=['sessions.id'],
-            where={'lower(speakers.speaker_name)': speaker_name.lower()}   
+        return list(self.iter_lookup('speaker', speaker_name))
+
+    #
+    # Counts the sessions of each speaker, read from the session_speakers speaker_id index
+    # without touching the sessions.
+    #
+    # \param speaker_name  string  only count the sessions of this speaker (case-insensitive).
+    #                              None counts the sessions of every speaker
+    #
+    # \return List of { 'speaker_name': ..., 'session_count': ... }, most sessions first
+    #
+    def speaker_counts(self, speaker_name=None):
+        query = ("SELECT speakers.speaker_name, count(*) AS session_count FROM speakers"
+                 " JOIN session_speakers ON session_speakers.speaker_id = speakers.id")
+        params = []
+        if speaker_name is not None:
+            query += " WHERE speakers.name_key = ?"
+            params.append(speaker_name.lower())
+        query += " GROUP BY speakers.id ORDER BY session_count DESC, speakers.name_key"
+        return self.speakers.query(query, params)
+
+    #
+    # Finds the speakers whose name resembles the given one, or starts with it, through the
+    # speaker_trigrams index (see agenda_trigrams): the candidates are the speakers sharing enough
+    # trigrams with the searched name, counted and ranked by similarity from range scans of the
+    # trigram index without reading the other speakers. Only the returned speakers are then read.
+    #
+    # A fuzzy match tolerates misspellings and missing or extra words (e.g. a middle initial): a
+    # speaker matches if the similarity of its name is at least threshold.
+    # A prefix match requires every word of the searched text to start a word of the speaker name,
+    # in order, e.g. 'ann mar' matches 'Anna Marshall', so the speaker must have all its trigrams.
+    #
+    # \param name       string   approximate name, or beginning of the name if prefix is set
+    # \param prefix     boolean  whether to match the beginning of the names instead of whole names
+    # \param limit      integer  maximum number of speakers returned
+    # \param threshold  float    minimum similarity of the fuzzy matches, from 0 to 1
+    #
+    # \return List of { 'speaker_name': ..., 'similarity': ..., 'session_count': ... }, most
+    #         similar first
+    #
+    def match_speakers(self, name, prefix=False, limit=DEFAULT_MATCHES, threshold=SIMILARITY_THRESHOLD):
+        grams = prefix_trigrams(name) if prefix else trigrams(name)
+        if not grams:
+            return []
+
+        # prefix candidates are checked one by one below, so they cannot be limited in SQL
+        query, params = self.speaker_candidates_query(grams, prefix, threshold, None if prefix else limit)
+        speaker_query = ("SELECT speaker_name, (SELECT count(*) FROM session_speakers"
+                         " WHERE session_speakers.speaker_id = speakers.id) AS session_count"
+                         " FROM speakers WHERE id = ?")
+        matches = []
+        for speaker_id, score in self.speaker_trigrams.iter_query(query, params, row_mode='tuple'):
+            if len(matches) == limit:
+                break
+            speaker = self.speakers.query(speaker_query, [speaker_id])[0]
+            if not prefix or is_word_prefix(name, speaker['speaker_name']):
+                matches.append(dict(speaker, similarity=round(score, 3)))
+        return matches
+
+    #
+    # Builds the query of the speakers sharing trigrams with a searched name, most similar first.
+    # Each trigram is a range of the covering (trigram, speaker_id, trigram_count) index, from
+    # which the similarity of every candidate is computed (see agenda_trigrams.similarity).
+    # A speaker needs at least threshold times the trigrams of the searched name to be similar
+    # enough, and all of them to be a prefix match.
+    #
+    # \param grams      set      trigrams of the searched name
+    # \param prefix     boolean  whether the speakers must have all the trigrams
+    # \param threshold  float    minimum similarity of the fuzzy matches
+    # \param limit      integer  maximum number of speakers returned, None for all of them
+    #
+    # \return (SELECT query string returning (speaker_id, similarity) rows, params)
+    #
+    def speaker_candidates_query(self, grams, prefix, threshold, limit=None):
+        placeholders = ', '.join('?' * len(grams))
+        query = (
+            "SELECT speaker_id, count(*) * 1.0 / (? + max(trigram_count) - count(*)) AS similarity"
+            f" FROM speaker_trigrams WHERE trigram IN ({placeholders})"
+            " GROUP BY speaker_id HAVING count(*) >= ? AND similarity >= ?"
+            " ORDER BY similarity DESC, speaker_id"
         )
-        for row in found_ids:
-            session_id = row['sessions.id']
-            self.grab_rows(out, duplicate, session_id)
-        
-        return out
+        params = [len(grams)] + sorted(grams) + [len(grams) if prefix else threshold * len(grams),
+                                                 0 if prefix else threshold]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return query, params
 
     #
-    # Gathers all the rows that correspond to the given session id. If the session id
-    # has sub-sessions, it will also gather those as well. Note that there will be no
-    # duplicate sessions returned.
+    # Full-text search through the session titles and descriptions.
+    # Supports the FTS5 query syntax: words (all must match), prefixes (cloud*), phrases
+    # ("cloud operating system"), OR / NOT operators and column filters (session_title: keynote).
+    # Matched sessions are ranked by relevance (bm25), each followed by its sub-sessions.
     #
-    # \param out         list     contains all the sessions to be displayed.
-    # \param duplicate   set      contains all sessions that were found to prevent
-    #                             duplicate sessions from being displayed
+    # \param text_query  string  the full-text query
     #
-    # \param session_id  integer  the session id to be searched for in the database
+    # \return List of all the matched sessions and their sub-sessions, best matches first
     #
-    def grab_rows(self, out, duplicate, session_id):
-        # Check to make sure we don't have duplicate outputs.
-        if session_id in duplicate:
-            return
-        
-        row = self.sessions.select(where={'id':session_id})[0]
+    # \error sqlite3.OperationalError is thrown if the query is not a valid FTS5 query
+    #
+    def lookup_text(self, text_query):
+        return self.expand_sessions(self.seed_query(self.TEXT_SEARCH), [text_query])
+
+    #
+    # Runs a compound query, combining column and speaker lookups with AND / OR / IN, e.g.
+    # "speaker = 'Al Davis' AND location IN ('Room 1', 'Room 2') AND date = 06/16/2018".
+    # The whole query runs as a single SQL statement, see compound_query.
+    #
+    # \param query  string  the compound query, see agenda_query for the syntax
+    #
+    # \return List of all the matched sessions and their sub-sessions
+    #
+    # \error ValueError is thrown if the query is malformed or uses an unknown column
+    #
+    def lookup_query(self, query):
+        return list(self.iter_lookup(self.QUERY, query))
+
+    #
+    # Builds the seed query of a compound query, see seed_query. Every predicate is checked
+    # against its own index (see agenda_query.compile_query) and sub-sessions are then expanded
+    # once for the whole result, rather than running a full lookup per predicate and
+    # intersecting the results.
+    #
+    # \param query  string  the compound query, see agenda_query for the syntax
+    #
+    # \return (SELECT query string returning (id, ord) rows, params)
+    #
+    # \error ValueError is thrown if the query is malformed or uses an unknown column
+    #
+    def compound_query(self, query):
+        condition, params = compile_query(parse_query(query, self.VALID_COLS))
+        return f"SELECT id, id AS ord FROM sessions WHERE {condition}", params
+
+    #
+    # Builds the query returning the ids of the sessions directly matched by a lookup, along
+    # with the order in which they should be returned, taking the lookup value as its only
+    # parameter. The lower(column) comparisons match the expression indexes declared in
+    # agenda_schema, and a speaker is found through its unique case-folded name, its sessions
+    # then being a range of the session_speakers index.
+    #
+    # \param column  string  the column that the user wishes to search by, 'speaker' or TEXT_SEARCH
+    #
+    # \return SELECT query string, returning (id, ord) rows
+    #
+    def seed_query(self, column):
+        if column == 'speaker':
+            return ("SELECT session_speakers.session_id AS id, session_speakers.session_id AS ord "
+                    "FROM speakers JOIN session_speakers ON session_speakers.speaker_id = speakers.id "
+                    "WHERE speakers.name_key = ?")
+        if column == self.TEXT_SEARCH:
+            return ("SELECT rowid AS id, row_number() OVER (ORDER BY rank) AS ord FROM sessions_fts "
+                    "WHERE sessions_fts MATCH ?")
+        return f"SELECT id, id AS ord FROM sessions WHERE lower({column}) = ?"
+
+    #
+    # Checks with EXPLAIN QUERY PLAN that the lookup of every column in VALID_COLS, and the
+    # sub-session expansion, are answered through indexes rather than full table scans.
+    #
+    # \return dict mapping each checked lookup to a (uses_index, query plan) tuple
+    #
+    def check_indexes(self):
+        report = {}
+        for column in sorted(self.VALID_COLS):
+            query = self.seed_query(column)
+            report[column] = (self.sessions.uses_index(query, ['']), self.sessions.explain(query, ['']))
+
+        query = "SELECT id FROM sessions WHERE main_session_id = ?"
+        report['sub-sessions'] = (self.sessions.uses_index(query, [0]), self.sessions.explain(query, [0]))
+
+        query, params = self.speaker_candidates_query(trigrams('al davis'), False, SIMILARITY_THRESHOLD, 1)
+        report['speaker-trigrams'] = (self.speakers.uses_index(query, params), self.speakers.explain(query, params))
 
-        out.append(row)
-        duplicate.add(session_id)
+        query, params = self.compound_query("speaker = '' AND (location IN ('', '') OR date = '')")
+        report['compound'] = (self.sessions.uses_index(query, params), self.sessions.explain(query, params))
 
-        is_main = row['main_session_id'] == None
-        
-        # if subsessions exist for this session, recursively find the other sessions
-        sub_ids = self.sessions.select(where={'main_session_id': session_id})
-        for sub_id in sub_ids:
-            self.grab_rows(out, duplicate, sub_id['id'])
+        query, params = self.overlapping_query(datetime(2000, 1, 1), datetime(2000, 1, 2))
+        report['time-range'] = (self.sessions.uses_index(query, params), self.sessions.explain(query, params))
+        return report
 
+    #
+    # Gathers the sessions running at a given time, i.e. started at or before it and ending after it.
+    #
+    # \param moment  string  the date and time, e.g. '2018-06-16 08:30' or '06/16/2018 08:30 AM'
+    #
+    # \return List of the sessions running at that time, by starting time
+    #
+    # \error ValueError is thrown if the time cannot be parsed
+    #
+    def lookup_running(self, moment):
+        # timestamps have a minute precision, so starting before the next second is starting at or
+        # before the given time
+        start = parse_timestamp(moment)
+        return list(self.iter_overlapping(start, start + timedelta(seconds=1)))
+
+    #
+    # Gathers the sessions overlapping a time window, i.e. starting before its end and ending
+    # after its start.
+    #
+    # \param start  string  start of the window, e.g. '2018-06-16 08:30' or '06/16/2018 08:30 AM'
+    # \param end    string  end of the window
+    #
+    # \return List of the sessions overlapping the window, by starting time
+    #
+    # \error ValueError is thrown if a time cannot be parsed, or if the window ends before it starts
+    #
+    def lookup_overlapping(self, start, end):
+        start, end = parse_timestamp(start), parse_timestamp(end)
+        if end < start:
+            raise ValueError('the time window ends before it starts')
+        return list(self.iter_overlapping(start, end))
+
+    #
+    # Streaming variant of lookup_overlapping, yielding the sessions as they are read.
+    #
+    # \param start  datetime  start of the window
+    # \param end    datetime  end of the window
+    #
+    def iter_overlapping(self, start, end):
+        query, params = self.overlapping_query(start, end)
+        return self.sessions.iter_query(query, params)
+
+    #
+    # Builds the query of the sessions overlapping a time window.
+    # A session overlaps the window if it starts before the end of the window and ends after its
+    # start. Since sessions last less than MAX_DURATION, they also start less than MAX_DURATION
+    # before the start of the window, which bounds the range scanned on the starts_at index to
+    # the sessions that could overlap the window instead of every earlier session.
+    #
+    # \param start  datetime  start of the window
+    # \param end    datetime  end of the window
+    #
+    # \return (SELECT query string, params)
+    #
+    def overlapping_query(self, start, end):
+        columns = ', '.join(self.sessions.schema)
+        query = (f"SELECT {columns} FROM sessions"
+                 " WHERE starts_at > ? AND starts_at < ? AND ends_at > ?"
+                 " ORDER BY starts_at, id")
+        return query, [format_timestamp(start - MAX_DURATION), format_timestamp(end), format_timestamp(start)]
+
+    #
+    # Detects the rooms booked by several sessions at the same time.
+    # Every session is paired with the sessions of the same room (case-insensitive) starting
+    # during it, found through a range scan of the room_starts_at index. Sessions without a
+    # location are ignored, as are a session and its own sub-sessions.
+    #
+    # \return List of (session, session) pairs of overlapping sessions sharing a room, the first
+    #         one starting first, by starting time
+    #
+    def lookup_double_bookings(self):
+        fields = list(self.sessions.schema)
+        columns = ', '.join([ f"a.{col}" for col in fields ] + [ f"b.{col}" for col in fields ])
+        query = (
+            f"SELECT {columns} FROM sessions AS a JOIN sessions AS b"
+            " ON lower(b.location) = lower(a.location)"
+            " AND b.starts_at >= a.starts_at AND b.starts_at < a.ends_at"
+            " WHERE a.location != ''"
+            " AND (b.starts_at > a.starts_at OR b.id > a.id)"
+            " AND a.id IS NOT b.main_session_id AND b.id IS NOT a.main_session_id"
+            " ORDER BY a.starts_at, a.id, b.starts_at, b.id"
+        )
+        pairs = []
+        for row in self.sessions.iter_query(query, row_mode='tuple'):
+            pairs.append((dict(zip(fields, row[:len(fields)])), dict(zip(fields, row[len(fields):]))))
+        return pairs
+
+    #
+    # Gathers all the sessions matched by the given seed query along with all their
+    # sub-sessions, in a single query. The sub-session expansion is done inside SQLite
+    # through a recursive CTE over main_session_id instead of querying each session and
+    # its sub-sessions one by one.
+    #
+    # Sessions are returned depth first, each session being directly followed by its
+    # sub-sessions, and a session is only returned once even if it is matched several
+    # times (e.g. both directly and through its main session).
+    #
+    # \param seed_query  string         SELECT query returning the (id, ord) of the matched sessions,
+    #                                   ord being the order in which they should be returned
+    # \param params      array<string>  values bound to the placeholders of seed_query
+    #
+    # \return List of all the matched sessions and their sub-sessions
+    #
+    def expand_sessions(self, seed_query, params):
+        return list(self.iter_expand_sessions(seed_query, params))
+
+    #
+    # Streaming variant of expand_sessions, yielding the sessions as they are read.
+    #
+    # \param row_mode  string  format of the yielded rows, see db_table.ROW_MODES
+    #
+    def iter_expand_sessions(self, seed_query, params, row_mode='dict'):
+        # Each session gets the path of zero-padded ids leading to it from a matched session,
+        # prefixed by the order of that matched session. Ordering by path yields the depth first
+        # order, and keeping the smallest path of each session keeps its first occurrence.
+        # The instr() check protects against cycles.
+        columns = ', '.join([ f"sessions.{col}" for col in self.sessions.schema ])
+        query = (
+            "WITH RECURSIVE tree(id, path) AS ("
+            f" SELECT id, printf('#%012d/%012d', ord, id) FROM ({seed_query})"
+            " UNION ALL"
+            " SELECT sessions.id, tree.path || printf('/%012d', sessions.id)"
+            " FROM sessions JOIN tree ON sessions.main_session_id = tree.id"
+            " WHERE instr(tree.path, printf('/%012d', sessions.id)) = 0"
+            ")"
+            f" SELECT {columns} FROM sessions"
+            " JOIN (SELECT id, MIN(path) AS path FROM tree GROUP BY id) AS found"
+            " ON sessions.id = found.id"
+            " ORDER BY found.path"
+        )
+        return self.sessions.iter_query(query, params, row_mode)
+
+    #
+    # Runs many lookups at once, sharing the work between them:
+    # - identical lookups (same column and case-folded value) are only run once
+    # - the agenda is loaded once for the whole batch into an AgendaIndex (unless this instance
+    #   already has one), column and speaker lookups then being dictionary probes, and full-text
+    #   searches and compound queries only running their seed query, the sub-session expansion
+    #   being done in memory
+    #
+    # Results are the same, and in the same order, as the ones of iter_lookup.
+    #
+    # \param queries  iterable  (column, value) pairs, column being a VALID_COLS entry, TEXT_SEARCH
+    #                          or QUERY
+    #
+    # \return generator of (sessions, error) pairs, one per query in the same order. error is None
+    #         unless the lookup failed (e.g. malformed full-text or compound query), in which case
+    #         sessions is None
+    #
+    def lookup_many(self, queries):
+        if self.index is not None:
+            self.check_generation()
+        index   = self.index
+        results = {}
+
+        for column, value in queries:
+            param = value if column == self.TEXT_SEARCH else value.lower()
+            key = (column, param)
+
+            if key not in results:
+                if index is None:
+                    index = AgendaIndex(self.sessions, self.speakers)
+
+                if column not in (self.TEXT_SEARCH, self.QUERY):
+                    results[key] = (index.lookup(column, value), None)
+                else:
+                    try:
+                        if column == self.QUERY:
+                            seed_query, params = self.compound_query(value)
+                        else:
+                            seed_query, params = self.seed_query(column), [param]
+                        seeds = self.sessions.query(f"SELECT id FROM ({seed_query}) ORDER BY ord, id", params)
+                        sessions = index.expand([row['id'] for row in seeds])
+                        results[key] = ([record.as_dict() for record in sessions], None)
+                    except (sqlite3.OperationalError, ValueError) as e:
+                        results[key] = (None, str(e))
+
+            yield results[key]
 
     #
     # Close the database connection
@@ -156,27 +562,381 @@ class LookupAgenda:
     def close_conn(self):
         self.sessions.close()
         self.speakers.close()
+        self.session_speakers.close()
+        self.sessions_fts.close()
+        self.speaker_trigrams.close()
+
+
+#
+# Bounded LRU cache of lookup results, keyed by (column, case-folded value).
+# Invalidation is up to the owner, see LookupAgenda.check_generation.
+#
+class LookupCache:
+
+    #
+    # \param size  integer  maximum number of results kept
+    #
+    def __init__(self, size):
+        self.size    = size
+        self.entries = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+
+    #
+    # \return the cached sessions list, or None if the key is not cached
+    #
+    def get(self, key):
+        sessions = self.entries.get(key)
+        if sessions is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return sessions
+
+    #
+    # Caches a result, evicting the least recently used one if the cache is full
+    #
+    def put(self, key, sessions):
+        self.entries[key] = sessions
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+#
+# Displays the given sessions in a viewable manner, followed by their count.
+#
+# \param sessions  iterable  sessions to display, as returned by the lookups
+#
+# \return number of displayed sessions
+#
+def print_sessions(sessions):
+    count = 0
+    for out in sessions:
+        # sessions are dicts or sqlite3.Row objects, whose 'in' operator searches the values
+        if 'event' in out.keys():
+            print(f"Event: {out['event']}")
+        print(f"Date: {out['date']}\t Time start: {out['time_start']}\t Time End: {out['time_end']}")
+        print(f"Session Title: {out['session_title']}\t Location: {out['location']}")
+        print('Description:\n', out['description'])
+        print('='*80, '\n')
+        count += 1
+
+    print(f"\nTotal matching sessions: {count}")
+    return count
+
+
+#
+# Displays the speakers found by LookupAgenda.match_speakers.
+#
+# \param matches  list  speakers, most similar first
+#
+def print_speaker_matches(matches):
+    for match in matches:
+        print(f"{match['similarity']:6.3f} {match['session_count']:5d} sessions  {match['speaker_name']}")
+
+    print(f"\nTotal matching speakers: {len(matches)}")
+
+
+#
+# Displays the double bookings found by LookupAgenda.lookup_double_bookings, followed by their count.
+#
+# \param pairs  list  (session, session) pairs of overlapping sessions sharing a room
+#
+def print_double_bookings(pairs):
+    for first, second in pairs:
+        print(f"Location: {first['location']}")
+        for session in (first, second):
+            print(f"    {session['date']} {session['time_start']} - {session['time_end']}\t {session['session_title']}")
+        print('='*80, '\n')
+
+    print(f"\nTotal double bookings: {len(pairs)}")
+
+
+#
+# Batch lookup mode: reads one JSON query per line, e.g. {"column": "speaker", "value": "Al Davis"}
+# or {"column": "query", "value": "speaker = 'Al Davis' AND date = 06/16/2018"},
+# runs them all through LookupAgenda.lookup_many and writes one JSON result per line, in order:
+#   {"column": ..., "value": ..., "count": n, "sessions": [...]}
+#   {"column": ..., "value": ..., "error": "..."}  if the query is invalid
+#
+# \param lookup_agenda  LookupAgenda  lookup instance to query
+# \param lines          iterable      JSONL input lines
+# \param out            file          output stream
+#
+# \return number of failed queries
+#
+def run_batch(lookup_agenda, lines, out):
+    queries = []
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            query = json.loads(line)
+            column, value = str(query['column']).lower(), str(query['value'])
+        except (ValueError, TypeError, KeyError):
+            queries.append((None, None, f'line {line_num}: expected {{"column": ..., "value": ...}}'))
+            continue
+
+        if column not in LookupAgenda.VALID_COLS and column not in (LookupAgenda.TEXT_SEARCH, LookupAgenda.QUERY):
+            queries.append((column, value, f'Column must be one of the following: {LookupAgenda.VALID_COLS}'))
+        else:
+            queries.append((column, value, None))
+
+    valid = [(column, value) for column, value, error in queries if not error]
+    results = lookup_agenda.lookup_many(valid)
+
+    failures = 0
+    for column, value, error in queries:
+        if not error:
+            sessions, error = next(results)
+
+        if error:
+            failures += 1
+            record = {'column': column, 'value': value, 'error': error}
+        else:
+            record = {'column': column, 'value': value, 'count': len(sessions), 'sessions': sessions}
+        out.write(json.dumps(record) + '\n')
+
+    return failures
 
 
 def main():
-    lookup_agenda = LookupAgenda()
-    if len(sys.argv) < 3 and (sys.argv[1].lower() != 'speaker' and len(sys.argv) != 3):
-        print('Usage: ./lookup_agenda.py <column|speaker> <value>')
-        print(f"Valid column names are: {', '.join(lookup_agenda.VALID_COLS)}")
-        print('If using speaker, only input a single speaker\'s name')
-        print('If description has special characters, wrap whole description in \' \'.')
+    parser = argparse.ArgumentParser(usage='./lookup_agenda.py [--db <database path> | --server <url>] <column|speaker> <value>\n'
+                                           '       ./lookup_agenda.py [--db <database path> | --server <url>] --search <full-text query>\n'
+                                           '       ./lookup_agenda.py [--db <database path> | --server <url>] --query <compound query>\n'
+                                           '       ./lookup_agenda.py --all-events | --event <name> [--event <name>...] <column|speaker> <value>\n'
+                                           '       ./lookup_agenda.py [--db <database path>] --batch [<.jsonl file path>]\n'
+                                           '       ./lookup_agenda.py [--db <database path>] --at <time> | --between <start> <end> | --double-booked\n'
+                                           '       ./lookup_agenda.py [--db <database path>] --speaker-counts [<speaker>]\n'
+                                           '       ./lookup_agenda.py [--db <database path>] --fuzzy | --prefix speaker <approximate name>\n'
+                                           '       ./lookup_agenda.py [--db <database path>] --check-indexes')
+    parser.add_argument('column', nargs='?')
+    parser.add_argument('value', nargs='*')
+    parser.add_argument('--db', dest='db_path', default=None,
+                        help=f'SQLite database to look into (default: {db_table.DB_NAME})')
+    parser.add_argument('--event', dest='events', action='append', default=None, metavar='EVENT',
+                        help='look into the database of the named event instead of --db. when given several '
+                             'times, the lookup runs against all of them concurrently')
+    parser.add_argument('--all-events', action='store_true',
+                        help='run the lookup against every imported event concurrently')
+    parser.add_argument('--events-dir', default=None,
+                        help=f'directory holding the event databases (default: {DEFAULT_EVENTS_DIR})')
+    parser.add_argument('--check-indexes', action='store_true',
+                        help='check that every lookup is answered through an index')
+    parser.add_argument('--search', action='store_true',
+                        help='full-text search of the session titles and descriptions, e.g. '
+                             '\'cloud*\' or \'"operating system"\'. the query is the whole value')
+    parser.add_argument('--query', action='store_true',
+                        help='compound query combining column lookups with AND, OR and IN, e.g. '
+                             '"speaker = \'Al Davis\' AND location IN (\'Room 1\', \'Room 2\')". the query is the whole value')
+    parser.add_argument('--batch', nargs='?', const='-', default=None, metavar='JSONL_FILE',
+                        help='run the {"column": ..., "value": ...} queries read from the file (or stdin) '
+                             'and print one JSON result per line')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='load the agenda in memory and answer the lookups without SQL')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='answer the lookup from the memory-mapped agenda snapshot written by the '
+                             'importer, rebuilding it if the database changed since')
+    parser.add_argument('--at', default=None, metavar='TIME',
+                        help='sessions running at the given time, e.g. \'2018-06-16 08:30\' or \'06/16/2018 08:30 AM\'')
+    parser.add_argument('--between', nargs=2, default=None, metavar=('START', 'END'),
+                        help='sessions overlapping the given time window')
+    parser.add_argument('--double-booked', action='store_true',
+                        help='rooms booked by overlapping sessions')
+    parser.add_argument('--fuzzy', action='store_true',
+                        help='list the speakers whose name resembles the given one, most similar first')
+    parser.add_argument('--prefix', action='store_true',
+                        help='list the speakers whose name starts with the given words, e.g. \'ann mar\'')
+    parser.add_argument('--speaker-counts', action='store_true',
+                        help='number of sessions of every speaker, or of the given speaker')
+    parser.add_argument('--server', default=None,
+                        help='send the lookup to a running lookup server (see lookup_server.py) '
+                             'instead of opening the database, e.g. http://127.0.0.1:8765')
+    parser.add_argument('--stats', action='store_true',
+                        help='print statistics of the SQL statements run, at exit')
+    parser.add_argument('--slow-ms', type=float, default=None, metavar='MS',
+                        help='log the SQL statements taking at least MS milliseconds, with their query '
+                             'plan (implies --stats)')
+    args = parser.parse_args()
+
+    if args.stats or args.slow_ms is not None:
+        atexit.register(db_table.instrument(args.slow_ms).print_summary)
+
+    if (args.events or args.all_events) and (args.db_path or args.server):
+        parser.error('--event cannot be used with --db or --server')
+    if args.events and len(args.events) == 1 and not args.all_events:
+        try:
+            args.db_path = event_db_path(args.events[0], args.events_dir)
+        except ValueError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        if not os.path.exists(args.db_path):
+            print(f"Error: unknown event '{args.events[0]}'")
+            sys.exit(1)
+        args.events = None
+    if (args.events or args.all_events) and (args.check_indexes or args.speaker_counts or args.batch or args.at
+                                             or args.between or args.double_booked or args.snapshot
+                                             or args.fuzzy or args.prefix):
+        parser.error('only column, --search and --query lookups can run across several events')
+
+    if args.check_indexes:
+        check_indexes(LookupAgenda(args.db_path))
+        return
+
+    if args.speaker_counts:
+        lookup_agenda = LookupAgenda(args.db_path)
+        speaker_name = ' '.join(([args.column] if args.column else []) + args.value) or None
+        for count in lookup_agenda.speaker_counts(speaker_name):
+            print(f"{count['session_count']:5d}  {count['speaker_name']}")
         lookup_agenda.close_conn()
-        sys.exit(1)
+        return
+
+    if args.at or args.between or args.double_booked:
+        lookup_time(LookupAgenda(args.db_path), args)
+        return
+
+    if args.fuzzy or args.prefix:
+        if not args.column or args.column.lower() != 'speaker' or not args.value:
+            parser.error('--fuzzy and --prefix look up speakers: --fuzzy speaker <approximate name>')
+        lookup_agenda = LookupAgenda(args.db_path)
+        print_speaker_matches(lookup_agenda.match_speakers(' '.join(args.value), prefix=args.prefix))
+        lookup_agenda.close_conn()
+        return
+
+    if args.batch:
+        lookup_agenda = LookupAgenda(args.db_path, args.in_memory)
+        try:
+            if args.batch == '-':
+                failures = run_batch(lookup_agenda, sys.stdin, sys.stdout)
+            else:
+                with open(args.batch) as lines:
+                    failures = run_batch(lookup_agenda, lines, sys.stdout)
+        finally:
+            lookup_agenda.close_conn()
+        sys.exit(1 if failures else 0)
+
+    if args.search or args.query:
+        # the column argument is the first word of the query
+        col = LookupAgenda.TEXT_SEARCH if args.search else LookupAgenda.QUERY
+        val = ' '.join(([args.column] if args.column else []) + args.value)
+    else:
+        if not args.column or not args.value:
+            parser.print_usage()
+            print(f"Valid column names are: {', '.join(LookupAgenda.VALID_COLS)}")
+            print('If using speaker, only input a single speaker\'s name')
+            print('If description has special characters, wrap whole description in \' \'.')
+            sys.exit(1)
+
+        col, val = args.column.lower(), ' '.join(args.value)
+        if col not in LookupAgenda.VALID_COLS:
+            print(f'Error: Column must be one of the following: {LookupAgenda.VALID_COLS}')
+            sys.exit(1)
+
+    if args.events or args.all_events:
+        # imported here so that the other lookups do not pay for asyncio, async_lookup also
+        # depending on this module
+        import asyncio
+        from async_lookup import lookup_events
+        events = None if args.all_events else args.events
+        try:
+            print_sessions(asyncio.run(lookup_events(events, args.events_dir, col, val)))
+        except (ValueError, RuntimeError, sqlite3.OperationalError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        return
+
+    if args.server:
+        # imported here so that the local lookups do not pay for the http client
+        from lookup_server import fetch_lookup
+        try:
+            print_sessions(fetch_lookup(args.server, col, val))
+        except RuntimeError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        return
+
+    # full-text searches and compound queries are not part of the snapshot and go through SQL
+    if args.snapshot and col not in (LookupAgenda.TEXT_SEARCH, LookupAgenda.QUERY):
+        try:
+            snapshot = AgendaSnapshot.open_current(args.db_path)
+        except sqlite3.OperationalError as e:
+            # no imported database to read the generation from, or to build the snapshot of
+            print(f'Error: {e}')
+            sys.exit(1)
+        try:
+            print_sessions(snapshot.lookup(col, val))
+        finally:
+            snapshot.close()
+        return
 
-    col, val = sys.argv[1], ' '.join(sys.argv[2:])
-    if col.lower() not in lookup_agenda.VALID_COLS:
-        print(f'Error: Column must be one of the following: {lookup_agenda.VALID_COLS}')
+    lookup_agenda = LookupAgenda(args.db_path, args.in_memory)
+    try:
+        if not lookup_agenda.lookup(col, val) and col == 'speaker':
+            suggest_speakers(lookup_agenda, val)
+    except ValueError as e:
+        print(f'Error: invalid query: {e}')
+        sys.exit(1)
+    except sqlite3.OperationalError as e:
+        if col != LookupAgenda.TEXT_SEARCH:
+            raise
+        print(f'Error: invalid full-text query: {e}')
+        sys.exit(1)
+    finally:
         lookup_agenda.close_conn()
+
+#
+# Suggests the speakers with a name close to the one of a speaker lookup that found nothing.
+#
+def suggest_speakers(lookup_agenda, speaker_name):
+    matches = lookup_agenda.match_speakers(speaker_name, limit=5)
+    if matches:
+        print(f"Did you mean: {', '.join(match['speaker_name'] for match in matches)}?")
+
+#
+# Runs the time range lookup requested on the command line, see main.
+#
+# \param lookup_agenda  LookupAgenda  lookup instance to query
+# \param args           Namespace     parsed arguments, with at, between or double_booked set
+#
+def lookup_time(lookup_agenda, args):
+    try:
+        if args.double_booked:
+            print_double_bookings(lookup_agenda.lookup_double_bookings())
+        elif args.at:
+            print_sessions(lookup_agenda.lookup_running(args.at))
+        else:
+            print_sessions(lookup_agenda.lookup_overlapping(*args.between))
+    except ValueError as e:
+        print(f'Error: {e}')
         sys.exit(1)
+    finally:
+        lookup_agenda.close_conn()
 
-    lookup_agenda.lookup(col.lower(), val)
+#
+# Prints the query plan of every lookup and exits with an error if any of them does a full
+# table scan (e.g. the database was imported before the indexes were introduced).
+#
+# \param lookup_agenda  LookupAgenda  lookup instance to check
+#
+def check_indexes(lookup_agenda):
+    report = lookup_agenda.check_indexes()
     lookup_agenda.close_conn()
-    
+
+    for name, (uses_index, plan) in report.items():
+        print(f"{name}: {'OK' if uses_index else 'FULL SCAN'}")
+        for step in plan:
+            print(f"    {step}")
+
+    if not all(uses_index for uses_index, _ in report.values()):
+        print('Some lookups are not indexed, re-import the agenda to build the indexes.')
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import sqlite3
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from db_table import db_table
+from lookup_agenda import LookupAgenda
+
+#
+# Long running lookup server.
+# Keeps a single LookupAgenda (and so a single warm database connection) open and answers
+# lookups over HTTP on localhost, so that callers issuing many lookups do not pay for the
+# interpreter startup and the database setup on every query.
+#
+# GET /lookup?column=<column|speaker|search|query>&value=<value>
+#   200 { "column": ..., "value": ..., "count": n, "sessions": [ { "id": ..., "date": ..., ... } ] }
+#   400 { "error": "..." } if the column is invalid or the full-text or compound query is malformed
+#
+# Requests are served one at a time, on the thread owning the database connection.
+#
+class LookupServer(HTTPServer):
+
+    DEFAULT_HOST = '127.0.0.1'
+    DEFAULT_PORT = 8765
+
+    # Number of lookup results cached, see LookupAgenda
+    DEFAULT_CACHE_SIZE = 1024
+
+    #
+    # Binds the server and opens the database.
+    #
+    # \param host     string   interface to listen on. defaults to localhost only
+    # \param port     integer  port to listen on
+    # \param db_path    string   path to the SQLite database file. defaults to db_table.DB_NAME
+    # \param in_memory   boolean  whether to answer the lookups from an in-memory AgendaIndex
+    # \param cache_size  integer  number of lookup results cached, 0 to disable the cache
+    #
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, db_path=None, in_memory=False,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        super().__init__((host, port), LookupRequestHandler)
+        self.lookup_agenda = LookupAgenda(db_path, in_memory, cache_size)
+
+    #
+    # Runs a lookup and returns its result as a JSON serializable dict.
+    #
+    # \param column  string  the column to search by, 'speaker', LookupAgenda.TEXT_SEARCH or
+    #                        LookupAgenda.QUERY
+    # \param value   string  the value to search for
+    #
+    # \return { "column": ..., "value": ..., "count": n, "sessions": [...] }
+    #
+    # \error ValueError is thrown if the column is invalid or the full-text or compound query is
+    #                    malformed
+    #
+    def lookup(self, column, value):
+        column = column.lower()
+        if column not in LookupAgenda.VALID_COLS and column not in (LookupAgenda.TEXT_SEARCH, LookupAgenda.QUERY):
+            raise ValueError(f'Column must be one of the following: {LookupAgenda.VALID_COLS}')
+
+        try:
+            sessions = list(self.lookup_agenda.iter_lookup(column, value))
+        except sqlite3.OperationalError as e:
+            if column != LookupAgenda.TEXT_SEARCH:
+                raise
+            raise ValueError(f'invalid full-text query: {e}')
+
+        return {'column': column, 'value': value, 'count': len(sessions), 'sessions': sessions}
+
+    #
+    # Closes the socket and the database connection
+    #
+    def server_close(self):
+        super().server_close()
+        self.lookup_agenda.close_conn()
+
+
+#
+# HTTP handler of LookupServer, see LookupServer for the API.
+#
+class LookupRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/lookup':
+            self.send_json(404, {'error': f'unknown path {url.path}'})
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        if 'column' not in query or 'value' not in query:
+            self.send_json(400, {'error': 'column and value parameters are required'})
+            return
+
+        try:
+            self.send_json(200, self.server.lookup(query['column'][0], query['value'][0]))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+
+    #
+    # Sends the given dict as a JSON response.
+    #
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    #
+    # Access logs are disabled, the server is meant to answer many small queries.
+    #
+    def log_message(self, format, *args):
+        pass
+
+
+#
+# Thin client of LookupServer.
+#
+# \param server_url  string  base url of the server, e.g. http://127.0.0.1:8765
+# \param column      string  the column to search by, 'speaker', LookupAgenda.TEXT_SEARCH or
+#                            LookupAgenda.QUERY
+# \param value       string  the value to search for
+#
+# \return List of the matching sessions, as returned by LookupAgenda.iter_lookup
+#
+# \error RuntimeError is thrown if the server cannot be reached or rejects the lookup
+#
+def fetch_lookup(server_url, column, value):
+    url = server_url.rstrip('/') + '/lookup?' + urllib.parse.urlencode({'column': column, 'value': value})
+    try:
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)['sessions']
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get('error', str(e)))
+    except urllib.error.URLError as e:
+        raise RuntimeError(f'cannot reach lookup server {server_url}: {e.reason}')
+
+
+def main():
+    parser = argparse.ArgumentParser(usage='./lookup_server.py [--db <database path>] [--host <host>] [--port <port>] [--in-memory] [--cache-size <count>]\n'
+                                           '                        [--stats] [--slow-ms <ms>]')
+    parser.add_argument('--db', dest='db_path', default=None,
+                        help=f'SQLite database to look into (default: {db_table.DB_NAME})')
+    parser.add_argument('--host', default=LookupServer.DEFAULT_HOST,
+                        help=f'interface to listen on (default: {LookupServer.DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=LookupServer.DEFAULT_PORT,
+                        help=f'port to listen on (default: {LookupServer.DEFAULT_PORT})')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='load the agenda in memory and answer the lookups without SQL')
+    parser.add_argument('--cache-size', type=int, default=LookupServer.DEFAULT_CACHE_SIZE,
+                        help=f'number of lookup results cached, 0 to disable (default: {LookupServer.DEFAULT_CACHE_SIZE})')
+    parser.add_argument('--stats', action='store_true',
+                        help='print statistics of the SQL statements run, at exit')
+    parser.add_argument('--slow-ms', type=float, default=None, metavar='MS',
+                        help='log the SQL statements taking at least MS milliseconds, with their query '
+                             'plan (implies --stats)')
+    args = parser.parse_args()
+
+    if args.stats or args.slow_ms is not None:
+        atexit.register(db_table.instrument(args.slow_ms).print_summary)
+
+    server = LookupServer(args.host, args.port, args.db_path, args.in_memory, args.cache_size)
+    print(f'Serving agenda lookups on http://{args.host}:{args.port}/lookup')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()